@@ -0,0 +1,111 @@
+""" Paired image/mask augmentation shared by COCO and portrait training. """
+import numpy as np
+
+
+class PairedAugmenter:
+    """ Apply the same random geometric transform to images and their masks.
+
+    Transforms are defined in normalized coordinates ([-1, 1] along both
+    axes), so a mask stored at another resolution than the image (like
+    portrait masks) gets exactly the same field of view. Images are
+    resampled bilinearly, masks by nearest neighbour, and sampling is
+    vectorized over the whole batch. Pixels outside the source are taken
+    from the nearest border, as in keras ImageDataGenerator.
+
+    Args:
+        rotation_range: float, degrees, rotation is uniform in [-range, range]
+        zoom_range: float, zoom is uniform in [1 - range, 1 + range]
+        shift_range: float, fraction of size, shift is uniform in [-range, range]
+        horizontal_flip: bool, whether to flip half of samples
+        seed: int, random seed
+    """
+
+    def __init__(self, rotation_range=0., zoom_range=0., shift_range=0.,
+                 horizontal_flip=False, seed=None):
+        self.rotation_range = rotation_range
+        self.zoom_range = zoom_range
+        self.shift_range = shift_range
+        self.horizontal_flip = horizontal_flip
+        self.rng = np.random.RandomState(seed)
+
+    def sample(self, n, aspect=1., rng=None):
+        """ Sample `n` affine transforms of normalized coordinates.
+
+        Args:
+            n: int, number of transforms
+            aspect: float, height/width of image, keeps rotation rigid
+                in pixel space
+            rng: RandomState, defaults to augmenter own one
+
+        Returns:
+            A: np.array [n, 2, 2], maps output (y, x) to source (y, x)
+            t: np.array [n, 2], shift
+        """
+        rng = rng or self.rng
+        theta = np.deg2rad(rng.uniform(-self.rotation_range,
+                                       self.rotation_range, n))
+        zoom = rng.uniform(1 - self.zoom_range, 1 + self.zoom_range, n)
+        t = rng.uniform(-self.shift_range, self.shift_range, (n, 2))*2
+        flip = np.ones(n)
+        if self.horizontal_flip:
+            flip[rng.rand(n) < 0.5] = -1
+
+        cos, sin = np.cos(theta)/zoom, np.sin(theta)/zoom
+        # rotation in pixel units: S^-1 R S with S = diag(aspect, 1)
+        A = np.empty((n, 2, 2))
+        A[:, 0, 0] = cos
+        A[:, 0, 1] = -sin/aspect
+        A[:, 1, 0] = sin*aspect
+        A[:, 1, 1] = cos
+        A[:, :, 1] *= flip[:, None]
+        return A, t
+
+    @staticmethod
+    def _source_coords(A, t, height, width):
+        """ Return source pixel coordinates ys, xs, both [n, height, width]. """
+        v = (np.arange(height) + 0.5)/height*2 - 1
+        u = (np.arange(width) + 0.5)/width*2 - 1
+        src_v = (A[:, 0, 0, None, None]*v[None, :, None] +
+                 A[:, 0, 1, None, None]*u[None, None, :] + t[:, 0, None, None])
+        src_u = (A[:, 1, 0, None, None]*v[None, :, None] +
+                 A[:, 1, 1, None, None]*u[None, None, :] + t[:, 1, None, None])
+        ys = (src_v + 1)/2*height - 0.5
+        xs = (src_u + 1)/2*width - 0.5
+        return np.clip(ys, 0, height - 1), np.clip(xs, 0, width - 1)
+
+    @staticmethod
+    def _bilinear(imgs, ys, xs):
+        n, height, width = ys.shape
+        b = np.arange(n)[:, None, None]
+        y0 = np.floor(ys).astype(np.int64)
+        x0 = np.floor(xs).astype(np.int64)
+        y1 = np.minimum(y0 + 1, height - 1)
+        x1 = np.minimum(x0 + 1, width - 1)
+        wy = (ys - y0)[..., None].astype(imgs.dtype)
+        wx = (xs - x0)[..., None].astype(imgs.dtype)
+        top = imgs[b, y0, x0]*(1 - wx) + imgs[b, y0, x1]*wx
+        bottom = imgs[b, y1, x0]*(1 - wx) + imgs[b, y1, x1]*wx
+        return top*(1 - wy) + bottom*wy
+
+    @staticmethod
+    def _nearest(masks, ys, xs):
+        b = np.arange(len(masks))[:, None, None]
+        return masks[b, np.rint(ys).astype(np.int64), np.rint(xs).astype(np.int64)]
+
+    def transform(self, imgs, masks, rng=None):
+        """ Return randomly transformed copies of images and masks.
+
+        Args:
+            imgs: np.array [batch, height, width, channels], float
+            masks: np.array [batch, mask_height, mask_width(, channels)]
+            rng: RandomState, defaults to augmenter own one
+
+        Returns:
+            imgs, masks with the same shapes and dtypes
+        """
+        A, t = self.sample(len(imgs), imgs.shape[1]/imgs.shape[2], rng)
+        ys, xs = self._source_coords(A, t, imgs.shape[1], imgs.shape[2])
+        imgs = self._bilinear(imgs, ys, xs)
+        ys, xs = self._source_coords(A, t, masks.shape[1], masks.shape[2])
+        masks = self._nearest(masks, ys, xs)
+        return imgs, masks
@@ -0,0 +1,185 @@
+""" Deterministic index-addressable datasets shared by all weeks.
+
+Every week keeps its own `tools.py`, which imports this module from the
+repository root and subclasses `IndexedSequence` for its data.
+"""
+import os
+import json
+import math
+
+import numpy as np
+from keras.utils import Sequence
+from keras.callbacks import Callback
+
+
+class IndexedSequence(Sequence):
+    """ Base of deterministic index-addressable datasets.
+
+    Samples are read in epochs (passes over the dataset). Order of samples
+    in every epoch is a permutation seeded by (seed, epoch), and every batch
+    gets its own RandomState seeded by (seed, epoch, cursor) for random
+    choices and augmentation. So a batch depends only on seed and its
+    position, and any keras worker (thread or process) builds the same batch.
+
+    Keras requests indexes 0, 1, ... of every sweep over the sequence,
+    whatever `steps_per_epoch` is. Position of a batch is restored from
+    `step`, number of batches consumed by training, and `start`, position of
+    index 0 of the current sweep, both kept by `SequenceCheckpoint`. Keras
+    must not prefetch a whole sweep ahead, so its queue is bounded by
+    `queue_size`. Subclasses implement `get_batch`.
+
+    Args:
+        n_samples: int, number of samples in one epoch
+        batch_size: int
+        seed: int, random seed
+        shuffle: bool, whether to permute samples every epoch
+    """
+
+    def __init__(self, n_samples, batch_size, seed=0, shuffle=True):
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.seed = seed
+        self.shuffle = shuffle
+        self.step = 0
+        self.start = 0
+        self._permutation = (None, None) # (epoch, permutation)
+
+    def __len__(self):
+        return int(math.ceil(self.n_samples / self.batch_size))
+
+    def position(self, idx):
+        """ Return (epoch, cursor) of batch `idx` of the current sweep. """
+        n = len(self)
+        # requested batch is less than a sweep ahead of consumed ones
+        return divmod(self.step + (self.start + idx - self.step) % n, n)
+
+    def epoch_permutation(self, n, epoch):
+        """ Return permutation of `n` items for `epoch`. """
+        if not self.shuffle:
+            return np.arange(n)
+        cached_epoch, permutation = self._permutation
+        if cached_epoch != epoch or len(permutation) != n:
+            permutation = np.random.RandomState([self.seed, epoch]).permutation(n)
+            self._permutation = (epoch, permutation)
+        return permutation
+
+    def batch_indexes(self, idx):
+        """ Return sample indexes of batch `idx`. """
+        epoch, cursor = self.position(idx)
+        return self.epoch_permutation(self.n_samples, epoch)[
+            cursor*self.batch_size:(cursor+1)*self.batch_size]
+
+    def batch_rng(self, idx):
+        return np.random.RandomState([self.seed] + list(self.position(idx)))
+
+    def __getitem__(self, idx):
+        return self.get_batch(self.batch_indexes(idx), self.batch_rng(idx))
+
+    def get_batch(self, indexes, rng):
+        """ Build batch of samples `indexes` using only `rng` for randomness. """
+        raise NotImplementedError
+
+    def get_state(self):
+        """ Return json serializable position of training. """
+        epoch, cursor = divmod(self.step, len(self))
+        return {'seed': self.seed, 'epoch': epoch, 'cursor': cursor}
+
+    def set_state(self, state):
+        """ Continue from position returned by `get_state`. """
+        self.seed = state['seed']
+        self.step = state['epoch']*len(self) + state['cursor']
+        self.start = self.step
+
+
+class SequenceCheckpoint(Callback):
+    """ Keep position of training sequence and save it with the model.
+
+    Model and sequence state (`path_to_model`.json) are saved together
+    every `period` batches and at the end of every epoch, so a crashed run
+    resumes mid-epoch without replaying or skipping batches. Resumed keras
+    epoch starts over, but data continues where it stopped.
+
+    Args:
+        sequence: IndexedSequence passed to `fit_generator`
+        path_to_model: str, None to only track position
+        period: int, number of batches between saves, 0 to save only at
+            the end of epoch
+        save_weights_only: bool, whether to save model without optimizer
+    """
+
+    def __init__(self, sequence, path_to_model=None, period=0,
+                 save_weights_only=False):
+        super().__init__()
+        self.sequence = sequence
+        self.path_to_model = path_to_model
+        self.period = period
+        self.save_weights_only = save_weights_only
+        self.epoch = 0
+
+    def on_train_begin(self, logs=None):
+        # keras starts a new sweep on every fit_generator call
+        self.sequence.start = self.sequence.step
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_batch_end(self, batch, logs=None):
+        self.sequence.step += 1
+        if self.period and self.sequence.step % self.period == 0:
+            self.save(self.epoch)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.save(epoch + 1)
+
+    def on_train_end(self, logs=None):
+        # model is already saved at the end of the last epoch
+        if self.path_to_model is not None:
+            self._write_state(self.epoch + 1, finished=True)
+            self._commit_state()
+
+    def _write_state(self, train_epoch, finished=False):
+        state = dict(self.sequence.get_state(), train_epoch=train_epoch,
+                     finished=finished)
+        with open(self.path_to_model + '.json.tmp', 'w') as f:
+            json.dump(state, f)
+
+    def _commit_state(self):
+        os.replace(self.path_to_model + '.json.tmp', self.path_to_model + '.json')
+
+    def save(self, train_epoch):
+        """ Save model and state, `train_epoch` is keras epoch to resume from. """
+        if self.path_to_model is None:
+            return
+        # write to temporary files first, so crash never leaves a half
+        # written checkpoint or a state that does not match the model
+        tmp_model = self.path_to_model + '.tmp'
+        if self.save_weights_only:
+            self.model.save_weights(tmp_model, overwrite=True)
+        else:
+            self.model.save(tmp_model, overwrite=True)
+        self._write_state(train_epoch)
+        os.replace(tmp_model, self.path_to_model)
+        self._commit_state()
+
+
+def queue_size(sequence, max_queue_size):
+    """ Return keras `max_queue_size` that keeps positions of `sequence` right.
+
+    Besides the queue keras holds one batch in training and one submitted
+    batch waiting for a free slot, all of them must be in one sweep.
+
+    Raises:
+        ValueError: if sequence is too short to be prefetched at all
+    """
+    size = min(max_queue_size, len(sequence) - 2)
+    if size < 1:
+        raise ValueError('Sequence of {} batches is too short to prefetch, '
+                         'use a smaller batch size'.format(len(sequence)))
+    return size
+
+def load_sequence_state(path_to_model):
+    """ Return state saved by SequenceCheckpoint next to model or None. """
+    if not os.path.isfile(path_to_model + '.json'):
+        return None
+    with open(path_to_model + '.json', 'r') as f:
+        return json.load(f)
@@ -0,0 +1,293 @@
+""" Optimize keras checkpoints of any week for inference.
+
+Loads architecture and weights (optimizer state and losses are dropped),
+removes dropout and noise layers, folds BatchNormalization into preceding
+Conv2D/Dense layers and saves both a light keras model and a frozen
+tensorflow graph. Works for nested models (Sequential inside
+TimeDistributed, like facial_recognizer) and plain Sequential models
+(charRNN). week2/export.py uses the same functions for its CPU export.
+
+Usage:
+    python optimize_model.py -path_to_model week2/models/model
+    python optimize_model.py -path_to_model week1/models/model5 \
+        -path_to_json week1/models/architecture.json
+"""
+import os
+import json
+import time
+import argparse
+
+import h5py
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+from keras.models import Model, model_from_config, model_from_json
+
+# layers that are identity at inference time
+TRAINING_ONLY_LAYERS = {'Dropout', 'SpatialDropout1D', 'SpatialDropout2D',
+                        'SpatialDropout3D', 'GaussianNoise', 'GaussianDropout',
+                        'AlphaDropout', 'ActivityRegularization'}
+FOLDABLE_LAYERS = {'Conv2D', 'Dense'}
+# keras axis of channels in output of foldable layers
+CHANNEL_AXES = {'Conv2D': (-1, 3), 'Dense': (-1, 1)}
+
+
+def load_checkpoint(path_to_model, path_to_json=None, custom_objects=None):
+    """ Load model architecture and weights, ignoring optimizer and losses.
+
+    Losses are not deserialized, so custom losses are not needed.
+
+    Args:
+        path_to_model: str, keras h5 saved by `save` or `save_weights`
+        path_to_json: str, architecture json for weights only checkpoints
+        custom_objects: dict, custom layers and functions of architecture
+    """
+    if path_to_json:
+        with open(path_to_json, 'r') as f:
+            model = model_from_json(f.read(), custom_objects=custom_objects)
+    else:
+        with h5py.File(path_to_model, 'r') as f:
+            if 'model_config' not in f.attrs:
+                raise ValueError('{} has only weights, provide architecture '
+                                 'with -path_to_json'.format(path_to_model))
+            config = f.attrs['model_config']
+        if isinstance(config, bytes):
+            config = config.decode('utf-8')
+        model = model_from_config(json.loads(config), custom_objects=custom_objects)
+    model.load_weights(path_to_model)
+    return model
+
+def iter_layers(layer):
+    """ Yield all leaf layers of (possibly nested) model or TimeDistributed. """
+    if isinstance(layer, Model):
+        for l in layer.layers:
+            yield from iter_layers(l)
+    elif layer.__class__.__name__ == 'TimeDistributed':
+        yield from iter_layers(layer.layer)
+    else:
+        yield layer
+
+def _fold(layer_config, bn_config, weights):
+    """ Return weights of Conv2D/Dense layer with BatchNormalization folded. """
+    layer_weights = weights[layer_config['config']['name']]
+    bn_weights = list(weights[bn_config['config']['name']])
+    gamma = bn_weights.pop(0) if bn_config['config']['scale'] else 1.
+    beta = bn_weights.pop(0) if bn_config['config']['center'] else 0.
+    mean, var = bn_weights
+    scale = gamma/np.sqrt(var + bn_config['config']['epsilon'])
+    bias = layer_weights[1] if len(layer_weights) > 1 else 0.
+    return [layer_weights[0]*scale, (bias - mean)*scale + beta]
+
+def _can_fold(layer_config, bn_config):
+    class_name = layer_config['class_name']
+    return (class_name in FOLDABLE_LAYERS and
+            layer_config['config']['activation'] == 'linear' and
+            bn_config['config']['axis'] in CHANNEL_AXES[class_name])
+
+def _optimize_sequential(layer_configs, weights, folded):
+    """ Optimize list of Sequential layer configs. """
+    result = []
+    input_shape = None
+    for l in layer_configs:
+        l = _optimize_layer(l, weights, folded)
+        if l['class_name'] in TRAINING_ONLY_LAYERS:
+            # first layer of Sequential keeps input shape of the model
+            input_shape = input_shape or l['config'].get('batch_input_shape')
+            continue
+        if (l['class_name'] == 'BatchNormalization' and result and
+                _can_fold(result[-1], l)):
+            prev = result[-1]
+            folded[prev['config']['name']] = _fold(prev, l, weights)
+            prev['config']['use_bias'] = True
+            continue
+        if not result and input_shape and 'batch_input_shape' not in l['config']:
+            l['config']['batch_input_shape'] = input_shape
+        result.append(l)
+    return result
+
+def _optimize_functional(config, weights, folded):
+    """ Optimize functional Model config in place. """
+    layers = {l['name']: l for l in config['layers']}
+    consumers = {name: 0 for name in layers}
+    for l in config['layers']:
+        for node in l['inbound_nodes']:
+            for inbound in node:
+                consumers[inbound[0]] += 1
+
+    renamed = {} # removed layer -> layer taking its place
+    for l in config['layers']:
+        l.update(_optimize_layer(l, weights, folded))
+        if len(l['inbound_nodes']) != 1 or len(l['inbound_nodes'][0]) != 1:
+            continue
+        source = l['inbound_nodes'][0][0][0]
+        if l['class_name'] in TRAINING_ONLY_LAYERS:
+            renamed[l['name']] = source
+        elif (l['class_name'] == 'BatchNormalization' and
+                consumers[source] == 1 and source not in renamed and
+                _can_fold(layers[source], l)):
+            folded[layers[source]['config']['name']] = _fold(layers[source], l, weights)
+            layers[source]['config']['use_bias'] = True
+            renamed[l['name']] = source
+
+    def resolve(name):
+        while name in renamed:
+            name = renamed[name]
+        return name
+
+    config['layers'] = [l for l in config['layers'] if l['name'] not in renamed]
+    for l in config['layers']:
+        for node in l['inbound_nodes']:
+            for inbound in node:
+                inbound[0] = resolve(inbound[0])
+    for output in config['output_layers']:
+        output[0] = resolve(output[0])
+    return config
+
+def _optimize_layer(layer_config, weights, folded):
+    """ Optimize nested models inside layer config. """
+    if layer_config['class_name'] == 'Sequential':
+        layer_config['config'] = _optimize_sequential(layer_config['config'],
+                                                      weights, folded)
+    elif layer_config['class_name'] == 'Model':
+        layer_config['config'] = _optimize_functional(layer_config['config'],
+                                                      weights, folded)
+    elif layer_config['class_name'] == 'TimeDistributed':
+        layer_config['config']['layer'] = _optimize_layer(
+            layer_config['config']['layer'], weights, folded)
+    return layer_config
+
+def optimize(model, custom_objects=None):
+    """ Return inference copy of model without training only layers and
+    with BatchNormalization folded into preceding Conv2D/Dense layers.
+
+    Model must be built with learning phase 0.
+    """
+    weights = {l.name: l.get_weights() for l in iter_layers(model)}
+    folded = {}
+    config = _optimize_layer({'class_name': model.__class__.__name__,
+                              'config': model.get_config()}, weights, folded)
+    new_model = model_from_config(config, custom_objects=custom_objects)
+    for layer in iter_layers(new_model):
+        layer.set_weights(folded.get(layer.name, weights[layer.name]))
+    return new_model
+
+def _to_float16(graph_def, min_size=1024):
+    """ Store large float32 constants as float16 followed by Cast. """
+    new_graph_def = tf.GraphDef()
+    for node in graph_def.node:
+        value = None
+        if node.op == 'Const' and node.attr['dtype'].type == tf.float32.as_datatype_enum:
+            value = tf.contrib.util.make_ndarray(node.attr['value'].tensor)
+        if value is None or value.size < min_size:
+            new_graph_def.node.extend([node])
+            continue
+        half = new_graph_def.node.add()
+        half.op = 'Const'
+        half.name = node.name + '/float16'
+        half.attr['dtype'].type = tf.float16.as_datatype_enum
+        half.attr['value'].tensor.CopyFrom(
+            tf.make_tensor_proto(value.astype(np.float16)))
+        cast = new_graph_def.node.add()
+        cast.op = 'Cast'
+        cast.name = node.name
+        cast.input.append(half.name)
+        cast.attr['SrcT'].type = tf.float16.as_datatype_enum
+        cast.attr['DstT'].type = tf.float32.as_datatype_enum
+    return new_graph_def
+
+def freeze(model, quantize=None):
+    """ Return frozen inference GraphDef of keras model.
+
+    Args:
+        model: keras Model built with learning phase 0
+        quantize: None, 'float16' or 'int8' weight quantization
+
+    Returns:
+        graph_def, input names, output names
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph
+
+    sess = K.get_session()
+    inputs = [t.op.name for t in model.inputs]
+    outputs = [t.op.name for t in model.outputs]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        sess, sess.graph.as_graph_def(), outputs)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def)
+    transforms = ['strip_unused_nodes', 'remove_nodes(op=Identity)',
+                  'fold_constants(ignore_errors=true)', 'fold_batch_norms']
+    if quantize == 'int8':
+        transforms.append('quantize_weights')
+    graph_def = TransformGraph(graph_def, inputs, outputs, transforms)
+    if quantize == 'float16':
+        graph_def = _to_float16(graph_def)
+    return graph_def, inputs, outputs
+
+def _random_inputs(model, batch_size):
+    shapes = [(batch_size,) + tuple(s[1:]) for s in
+              (model.input_shape if isinstance(model.input_shape, list)
+               else [model.input_shape])]
+    if any(d is None for s in shapes for d in s):
+        return None
+    return [np.random.random(s).astype(np.float32) for s in shapes]
+
+def _latency(predict, inputs, n_runs=5):
+    predict(inputs)
+    start = time.time()
+    for _ in range(n_runs):
+        predict(inputs)
+    return (time.time() - start)/n_runs
+
+def main(args):
+    K.set_learning_phase(0)
+    start = time.time()
+    model = load_checkpoint(args.path_to_model, args.path_to_json)
+    load_time = time.time() - start
+    optimized = optimize(model)
+
+    path = os.path.splitext(args.path_to_model)[0]
+    optimized.save(path + '_inference.h5')
+    graph_def, inputs, outputs = freeze(optimized, args.quantize)
+    with open(path + '_frozen.pb', 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(path + '_frozen.pb.json', 'w') as f:
+        json.dump({'inputs': inputs, 'outputs': outputs}, f)
+
+    print('layers: {} -> {}'.format(len(list(iter_layers(model))),
+                                    len(list(iter_layers(optimized)))))
+    print('checkpoint load: {:.2f} s'.format(load_time))
+    start = time.time()
+    graph_def = tf.GraphDef()
+    with open(path + '_frozen.pb', 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    sess = tf.Session(graph=graph)
+    print('frozen graph load: {:.2f} s'.format(time.time() - start))
+
+    feed = _random_inputs(model, args.batch_size)
+    if feed is None:
+        print('model has inputs of unknown size, latency is not measured')
+        return
+    in_tensors = [graph.get_tensor_by_name(n + ':0') for n in inputs]
+    out_tensors = [graph.get_tensor_by_name(n + ':0') for n in outputs]
+    keras_time = _latency(model.predict_on_batch, feed)
+    frozen_time = _latency(lambda x: sess.run(out_tensors, dict(zip(in_tensors, x))),
+                           feed)
+    print('batch latency: keras {:.1f} ms, frozen {:.1f} ms'.format(
+        keras_time*1000, frozen_time*1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-path_to_model', type=str,
+                        help="path to keras checkpoint")
+    parser.add_argument('-path_to_json', type=str, default=None,
+                        help="architecture json for weights only checkpoints")
+    parser.add_argument('-quantize', type=str, default=None,
+                        choices=['float16', 'int8'],
+                        help="weight quantization of frozen graph")
+    parser.add_argument('-batch_size', type=int, default=8,
+                        help="batch size for latency measurement")
+    args = parser.parse_args()
+    main(args)
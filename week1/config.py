@@ -18,7 +18,10 @@ train_config = Config(
     path_to_models = './models',
     epochs = 10,
     max_queue_size = 100,
-    workers = 1
+    workers = 1,
+    use_multiprocessing = False,
+    seed = 0, # data order and augmentation
+    checkpoint_period = 1000 # batches between resumable checkpoints, 0 - epoch end only
 )
 
 config = Config(
@@ -1,4 +1,5 @@
 import os
+import sys
 import fnmatch
 from operator import itemgetter
 import math
@@ -18,6 +19,12 @@ from keras.applications.vgg19 import preprocess_input
 from keras.preprocessing.image import (ImageDataGenerator, Iterator,
                                        array_to_img, img_to_array, load_img)
 
+# modules shared by all weeks live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indexed_sequence import (IndexedSequence, SequenceCheckpoint,
+                              load_sequence_state, queue_size)
+
+
 MAX_NUM_IMAGES_PER_CLASS = 2 ** 27 - 1  # ~134M
 VALID_IMAGE_FORMATS = frozenset(['jpg', 'jpeg', 'JPG', 'JPEG'])
 
@@ -302,41 +309,73 @@ def copy_images(config):
 
 
 
-def get_generators_standart(config):
-    def except_catcher(gen):
-        while True:
-            try:
-                data = next(gen)
-                yield data
-            except Exception as e:
-                print('Ups! Something wrong!', e)
-    
-    def normilize(img):
-        return (img/255 - 0.5)*2
+def normilize(img):
+    return (img/255 - 0.5)*2
 
+def get_generators_standart(config):
     train_datagen = ImageDataGenerator(rotation_range=45,
                                         width_shift_range=0.2,
                                         height_shift_range=0.2,
                                         zoom_range=0.2,
                                         horizontal_flip=True,
-                                        vertical_flip=True,
-                                        preprocessing_function=normilize)
+                                        vertical_flip=True)
 
-    test_datagen = ImageDataGenerator(preprocessing_function=normilize)
-
-    train_generator = train_datagen.flow_from_directory(
+    train_generator = DirectorySequence(
         directory=config.data.path_to_train,
-        target_size=(config.data.img_height, config.data.img_width),
-        batch_size=config.data.batch_size,
-        class_mode='categorical')
+        config=config,
+        datagen=train_datagen,
+        seed=config.train.seed)
 
-    validation_generator = test_datagen.flow_from_directory(
+    validation_generator = DirectorySequence(
         directory=config.data.path_to_test,
-        target_size=(config.data.img_height, config.data.img_width),
-        batch_size=config.data.batch_size,
-        class_mode='categorical')
+        config=config,
+        shuffle=False,
+        seed=config.train.seed)
+
+    return train_generator, validation_generator
+
+
+class DirectorySequence(IndexedSequence):
+    """ Batches of images and one-hot labels from class subdirectories.
+
+    Replaces `flow_from_directory`: random transforms are seeded by the
+    batch RandomState, so batches are reproducible and the sequence can be
+    used by keras worker processes.
+
+    Args:
+        directory: str, directory with one subdirectory per class
+        config: config
+        datagen: ImageDataGenerator, optional, random transforms
+        shuffle: bool, whether to permute images every epoch
+        seed: int, random seed
+    """
+
+    def __init__(self, directory, config, datagen=None, shuffle=True, seed=0):
+        self.classes = sorted(name for name in os.listdir(directory)
+                              if os.path.isdir(os.path.join(directory, name)))
+        self.paths = []
+        labels = []
+        for i, class_ in enumerate(self.classes):
+            paths = [p for p in find_files(os.path.join(directory, class_), '*')
+                     if p.rsplit('.', 1)[-1] in VALID_IMAGE_FORMATS]
+            self.paths.extend(paths)
+            labels.extend([i]*len(paths))
+        self.labels = np.array(labels, dtype=np.int64)
+        super().__init__(len(self.paths), config.data.batch_size, seed, shuffle)
+        self.target_size = (config.data.img_height, config.data.img_width)
+        self.datagen = datagen
+
+    def get_batch(self, indexes, rng):
+        batch_x = np.zeros((len(indexes),) + self.target_size + (3,),
+                           dtype=K.floatx())
+        for i, j in enumerate(indexes):
+            x = img_to_array(load_img(self.paths[j], target_size=self.target_size))
+            if self.datagen is not None:
+                x = self.datagen.random_transform(x, seed=rng.randint(2**31))
+            batch_x[i] = normilize(x)
+        batch_y = np.eye(len(self.classes), dtype=K.floatx())[self.labels[indexes]]
+        return batch_x, batch_y
 
-    return except_catcher(train_generator), except_catcher(validation_generator)
 
 class CustomImageDataGenerator(ImageDataGenerator):
     def flow_from_image_lists(self, image_lists,
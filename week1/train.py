@@ -46,30 +46,37 @@ def get_model(num_classes, n_fozen_layers, path_to_weights_load):
     # model.summary()
     return model
 
-def make_train_episode(model, layers, num_img, train_gen, valid_gen):
+def make_train_episode(model, layers, train_gen, valid_gen, initial_epoch=0):
     path_to_weights = os.path.join(config.train.path_to_models,
                                    'model{}'.format(layers))
+    # checkpoints keep only weights, architecture is needed to load them
+    # elsewhere (optimize_model.py -path_to_json)
+    with open(os.path.join(config.train.path_to_models, 'architecture.json'), 'w') as f:
+        f.write(model.to_json())
     call_backs =[
         EarlyStopping('val_acc', min_delta=1e-5, patience=20),
         ProgbarLogger('steps'),
         ModelCheckpoint(path_to_weights, save_best_only=True, save_weights_only=True),
         LearningRateScheduler(lambda x: tools.lr_scheduler(x, config)),
         CSVLogger(config.train.path_to_log),
-        TensorBoard(config.train.path_to_summaries)
+        TensorBoard(config.train.path_to_summaries),
+        tools.SequenceCheckpoint(train_gen, path_to_weights + '_last',
+                                 config.train.checkpoint_period,
+                                 save_weights_only=True)
         ]
 
-    steps_per_epoch=int((1-config.data.valid_size)*num_img/config.data.batch_size) // 1
-    validation_steps=int(config.data.valid_size*num_img/config.data.batch_size) // 1
     model.fit_generator(generator=train_gen,
-                        steps_per_epoch=steps_per_epoch,
+                        steps_per_epoch=len(train_gen),
                         epochs=config.train.epochs,
                         verbose=1,
                         callbacks=call_backs,
                         validation_data=valid_gen,
-                        validation_steps=validation_steps,
-                        max_queue_size=config.train.max_queue_size,
+                        validation_steps=len(valid_gen),
+                        max_queue_size=tools.queue_size(
+                            train_gen, config.train.max_queue_size),
                         workers=config.train.workers,
-                        use_multiprocessing=False)
+                        use_multiprocessing=config.train.use_multiprocessing,
+                        initial_epoch=initial_epoch)
 
 def main():
     os.makedirs(config.train.path_to_summaries, exist_ok=True)
@@ -78,29 +85,47 @@ def main():
     num_classes = len(os.listdir(config.data.path_to_train))
     print("Number of classes found: {}".format(num_classes))
     
-    # num_img = len(tools.find_files(config.data.path_to_data, '*.jpg'))
-    num_img = 652782
-    print("Number of images found: {}".format(num_img))
-
     # image_lists = tools.create_image_lists(config.data.path_to_data,
     #                                        config.data.valid_size*100)
 
     train_gen, valid_gen = tools.get_generators_standart(config)
+    num_img = train_gen.n_samples + valid_gen.n_samples
+    print("Number of images found: {}".format(num_img))
 
+    model = None
     for i, layers in enumerate(config.train.n_fozen_layers):
-        if i == 0:
+        # resume episode from its last checkpoint, data continues from
+        # the saved position of train sequence
+        path_to_last = os.path.join(config.train.path_to_models,
+                                    'model{}_last'.format(layers))
+        state = tools.load_sequence_state(path_to_last)
+        if state is not None:
+            train_gen.set_state(state)
+            if state['finished']:
+                print('EPISODE {} IS ALREADY TRAINED'.format(layers))
+                continue
+
+        if state is not None:
+            path_to_weights_load = path_to_last
+            initial_epoch = state['train_epoch']
+        elif i == 0:
             path_to_weights_load = None
+            initial_epoch = 0
         else:
             path_to_weights_load = os.path.join(config.train.path_to_models,
                 'model{}'.format(config.train.n_fozen_layers[i-1]))
+            initial_epoch = 0
         
         #path_to_weights_load = os.path.join(config.train.path_to_models,
         #        'model{}'.format('20'))
         #layers = 20/
 
         model = get_model(num_classes, layers, path_to_weights_load)
-        make_train_episode(model, layers, num_img, train_gen, valid_gen)
-    model.save_weights('.models/final_model')
+        make_train_episode(model, layers, train_gen, valid_gen, initial_epoch)
+    if model is None:
+        # every episode was trained by previous runs
+        model = get_model(num_classes, layers, path_to_last)
+    model.save_weights(os.path.join(config.train.path_to_models, 'final_model'))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
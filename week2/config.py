@@ -11,13 +11,28 @@ config = Config(
     img_width = 320, # after resize
     n_classes = 80, # 80 classes
     n_obj = 10,
+    # aspect ratio bucketing at native resolution, needs fully conv model
+    bucketing = False,
+    max_side = 640, # longer image side is scaled down to it
+    n_buckets = 8,
+    size_multiple = 32, # batches are padded to multiple of it
+    # paired image/target augmentation of train set, None to switch off
+    augment = dict(rotation_range=10, zoom_range=0.1, shift_range=0.1,
+                   horizontal_flip=True),
+    class_weight_by = 'count', # 'count', 'area', 'images' or 'cooccurrence'
 
     #train config
     path_to_summaries = './summaries',
     path_to_log = './log.csv',
     path_to_models = './models',
+    path_to_weights_cache = None, # None for ~/.keras/models
+    offline = False, # never download pretrained weights
     epochs = 100,
     max_queue_size = 100,
-    workers = 1
+    workers = 2, # threads requesting batches, workers*batch_size >= n_loaders
+    use_multiprocessing = False,
+    n_loaders = 4, # processes that build samples of concurrently requested batches
+    seed = 0, # data order and augmentation
+    checkpoint_period = 500 # batches between resumable checkpoints, 0 - epoch end only
     )
 
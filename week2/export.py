@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from keras import backend as K
+from keras.preprocessing import image
+
+from vggUnet import Interp, InterpLike, interp_like_shape
+
+# BatchNorm folding and freezing are shared with optimize_model.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from optimize_model import load_checkpoint, optimize, freeze
+
+CUSTOM_OBJECTS = {'Interp': Interp, 'InterpLike': InterpLike,
+                  'interp_like_shape': interp_like_shape}
+
+
+def load_inference_model(path_to_model):
+    """ Load architecture and weights of keras checkpoint without optimizer.
+
+    Losses are not deserialized, so custom losses of week2 models are
+    not needed to load them.
+    """
+    return load_checkpoint(path_to_model, custom_objects=CUSTOM_OBJECTS)
+
+def export(path_to_model, path_to_export, quantize=None):
+    """ Save optimized frozen graph of keras checkpoint for CPU inference.
+
+    Writes `path_to_export` (.pb) and `path_to_export`.json with names of
+    input and output tensors.
+    """
+    K.clear_session()
+    K.set_learning_phase(0)
+    model = optimize(load_inference_model(path_to_model), CUSTOM_OBJECTS)
+    graph_def, inputs, outputs = freeze(model, quantize)
+    with open(path_to_export, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(path_to_export + '.json', 'w') as f:
+        json.dump({'inputs': inputs, 'outputs': outputs,
+                   'input_shape': list(model.input_shape[1:])}, f)
+    return path_to_export
+
+
+class FrozenModel:
+    """ Run exported frozen graph with keras-like `predict`.
+
+    Args:
+        path_to_export: str, path to .pb written by `export`
+        n_threads: int, number of CPU threads, 0 for tensorflow default
+    """
+
+    def __init__(self, path_to_export, n_threads=0):
+        with open(path_to_export + '.json', 'r') as f:
+            meta = json.load(f)
+        self.input_shape = (None,) + tuple(meta['input_shape'])
+        graph_def = tf.GraphDef()
+        with open(path_to_export, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.inputs = [self.graph.get_tensor_by_name(n + ':0') for n in meta['inputs']]
+        self.outputs = [self.graph.get_tensor_by_name(n + ':0') for n in meta['outputs']]
+        tf_config = tf.ConfigProto(intra_op_parallelism_threads=n_threads,
+                                   inter_op_parallelism_threads=n_threads)
+        self.sess = tf.Session(graph=self.graph, config=tf_config)
+
+    def predict(self, x, batch_size=8):
+        results = [[] for _ in self.outputs]
+        for i in range(0, len(x), batch_size):
+            outs = self.sess.run(self.outputs, {self.inputs[0]: x[i:i+batch_size]})
+            for r, o in zip(results, outs):
+                r.append(o)
+        results = [np.concatenate(r) for r in results]
+        return results[0] if len(results) == 1 else results
+
+
+def _portrait_samples(path_to_imgs, path_to_masks, input_shape, n_samples):
+    import tools
+    imgs = tools.find_files(path_to_imgs, '*.jpg')[:n_samples]
+    masks = tools.find_files(path_to_masks, '*.npy')[:n_samples]
+    X = np.stack([image.img_to_array(image.load_img(p, target_size=input_shape[:2]))
+                  for p in imgs])/127.5 - 1
+    Y = np.stack([np.load(p) for p in masks]) > 0.5
+    return X.astype(np.float32), Y
+
+def _coco_samples(path_to_imgs, path_to_json, n_classes, input_shape, n_samples):
+    from pycocotools.coco import COCO
+    import tools
+    coco = COCO(path_to_json)
+    c = tools.Config(img_height=input_shape[0], img_width=input_shape[1],
+                     n_classes=n_classes)
+    img_ids = coco.getImgIds()[:n_samples]
+    cat_to_class_map = {cat: i for i, cat in enumerate(coco.getCatIds())}
+    X = tools.get_imgs_by_ids(img_ids, coco, c, path_to_imgs)
+    Y = tools.get_targets_by_ids(img_ids, coco, c, cat_to_class_map) > 0
+    return X.astype(np.float32), Y
+
+def _iou(pred, target):
+    pred = pred > 0.5
+    return (pred & target).sum() / max((pred | target).sum(), 1)
+
+def _timed_predict(model, X, batch_size, n_runs=3):
+    """ Return first output of `model` on X and best time per batch, s. """
+    times = []
+    for _ in range(n_runs):
+        start = time.time()
+        pred = model.predict(X, batch_size=batch_size)
+        times.append((time.time() - start) / max(len(X) // batch_size, 1))
+    if isinstance(pred, list):
+        pred = pred[0]
+    return pred, min(times)
+
+def report(path_to_model, path_to_export, X, Y, batch_size=8):
+    """ Print accuracy vs latency of keras model and exported graph.
+
+    Args:
+        X: np.array, held out normalized images
+        Y: np.array of bool, masks matching first model output
+    """
+    K.clear_session()
+    K.set_learning_phase(0)
+    rows = [('keras', load_inference_model(path_to_model), path_to_model),
+            ('frozen', FrozenModel(path_to_export), path_to_export)]
+    reference = None
+    print('{:8} {:>8} {:>12} {:>10} {:>10}'.format(
+        'model', 'IoU', 'ms/batch', 'size, MB', 'max diff'))
+    for name, model, path in rows:
+        pred, latency = _timed_predict(model, X, batch_size)
+        reference = pred if reference is None else reference
+        print('{:8} {:8.4f} {:12.1f} {:10.1f} {:10.4f}'.format(
+            name, _iou(pred, Y), latency*1000, os.path.getsize(path)/2**20,
+            np.abs(pred - reference).max()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-path_to_model', type=str, default='./models/model',
+                        help="path to saved keras model")
+    parser.add_argument('-path_to_export', type=str, default='./models/model.pb',
+                        help="path where frozen graph will be saved")
+    parser.add_argument('-quantize', type=str, default=None,
+                        choices=['float16', 'int8'],
+                        help="weight quantization")
+    parser.add_argument('-path_to_imgs', type=str, default=None,
+                        help="held out images for report")
+    parser.add_argument('-path_to_masks', type=str, default=None,
+                        help="held out portrait masks (.npy) for report")
+    parser.add_argument('-path_to_json', type=str, default=None,
+                        help="coco annotations of held out images for report")
+    parser.add_argument('-n_classes', type=int, default=80,
+                        help="number of coco classes")
+    parser.add_argument('-n_samples', type=int, default=64,
+                        help="number of held out images for report")
+    parser.add_argument('-batch_size', type=int, default=8)
+    args = parser.parse_args()
+
+    export(args.path_to_model, args.path_to_export, args.quantize)
+    with open(args.path_to_export + '.json', 'r') as f:
+        input_shape = json.load(f)['input_shape']
+    if args.path_to_imgs and args.path_to_masks:
+        X, Y = _portrait_samples(args.path_to_imgs, args.path_to_masks,
+                                 input_shape, args.n_samples)
+        report(args.path_to_model, args.path_to_export, X, Y, args.batch_size)
+    elif args.path_to_imgs and args.path_to_json:
+        X, Y = _coco_samples(args.path_to_imgs, args.path_to_json, args.n_classes,
+                             input_shape, args.n_samples)
+        report(args.path_to_model, args.path_to_export, X, Y, args.batch_size)
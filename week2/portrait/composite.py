@@ -0,0 +1,122 @@
+import numpy as np
+from PIL import Image
+from scipy import ndimage as nd
+
+
+def resize_uint8(arr, size, resample=Image.BILINEAR):
+    """ Resize 2D uint8 array to (height, width) `size` without float copy. """
+    if arr.shape[:2] == tuple(size):
+        return arr
+    return np.asarray(Image.fromarray(arr).resize((size[1], size[0]), resample))
+
+def boundary_band(prob, size, low=0.05, high=0.95, radius=1):
+    """ Return full resolution pixel coordinates near the mask boundary.
+
+    Args:
+        prob: np.array [height, width], low resolution foreground probability
+        size: (height, width) of full resolution image
+        low, high: float, probabilities treated as uncertain
+        radius: int, dilation of uncertain region in low resolution pixels
+
+    Returns:
+        ys, xs: np.array, coordinates of band pixels
+    """
+    band = (prob > low) & (prob < high)
+    hard = prob >= high
+    # edges between confident foreground and background belong to band too
+    band |= hard ^ nd.binary_erosion(hard)
+    band = nd.binary_dilation(band, iterations=radius)
+    band = resize_uint8(band.astype(np.uint8), size, Image.NEAREST)
+    return np.nonzero(band)
+
+def joint_bilateral(alpha, guide, ys, xs, radius=3, sigma_space=2., sigma_color=20.):
+    """ Refine alpha at (ys, xs) by joint bilateral filter guided by image.
+
+    Only band pixels and their neighbours are touched, memory is linear
+    in the number of band pixels.
+
+    Args:
+        alpha: np.array [height, width], uint8 alpha
+        guide: np.array [height, width, 3], uint8 image
+        ys, xs: np.array, coordinates to refine
+        radius: int, filter radius in full resolution pixels
+        sigma_space, sigma_color: float, gaussian widths in pixels and
+            in color units
+
+    Returns:
+        np.array, uint8 refined alpha values at (ys, xs)
+    """
+    height, width = alpha.shape
+    center = guide[ys, xs].astype(np.int32)
+    acc = np.zeros(len(ys), dtype=np.float32)
+    norm = np.zeros(len(ys), dtype=np.float32)
+    for dy in range(-radius, radius + 1):
+        yy = np.clip(ys + dy, 0, height - 1)
+        for dx in range(-radius, radius + 1):
+            xx = np.clip(xs + dx, 0, width - 1)
+            color = ((guide[yy, xx].astype(np.int32) - center)**2).sum(axis=-1)
+            w = np.exp(-(dy*dy + dx*dx)/(2*sigma_space**2) -
+                       color/(2*sigma_color**2)).astype(np.float32)
+            acc += w*alpha[yy, xx]
+            norm += w
+    return np.clip(np.rint(acc/norm), 0, 255).astype(np.uint8)
+
+def blend(img, background, alpha, chunk_rows=128):
+    """ Alpha blend uint8 images in place of `img` using integer math.
+
+    Args:
+        img: np.array [height, width, 3], uint8 foreground, overwritten
+        background: np.array [height, width, 3], uint8
+        alpha: np.array [height, width], uint8, 255 means foreground
+    """
+    for r in range(0, img.shape[0], chunk_rows):
+        a = alpha[r:r + chunk_rows, :, None].astype(np.uint16)
+        fg = img[r:r + chunk_rows].astype(np.uint16)
+        bg = background[r:r + chunk_rows].astype(np.uint16)
+        img[r:r + chunk_rows] = (fg*a + bg*(255 - a) + 127)//255
+    return img
+
+
+class Compositor:
+    """ Put foreground of image over new background by predicted mask.
+
+    Low resolution probability map is upsampled bilinearly as uint8 alpha
+    and refined by joint bilateral filter only in a band around the mask
+    boundary. Blending is done in uint8, so no full resolution float copy
+    of the image is made.
+
+    Args:
+        background: PIL image, new background
+        radius: int, bilateral filter radius
+        sigma_space, sigma_color: float, bilateral filter widths
+    """
+
+    def __init__(self, background, radius=3, sigma_space=2., sigma_color=20.):
+        self.background = background
+        self.radius = radius
+        self.sigma_space = sigma_space
+        self.sigma_color = sigma_color
+        self._backgrounds = {} # (height, width) -> resized background
+
+    def get_background(self, size):
+        if size not in self._backgrounds:
+            self._backgrounds[size] = np.asarray(
+                self.background.convert('RGB').resize((size[1], size[0])),
+                dtype=np.uint8)
+        return self._backgrounds[size]
+
+    def alpha(self, img, prob):
+        """ Return uint8 full resolution alpha for `img`. """
+        size = img.shape[:2]
+        alpha = resize_uint8(np.rint(prob*255).astype(np.uint8), size)
+        ys, xs = boundary_band(prob, size)
+        if len(ys):
+            alpha = alpha.copy()
+            alpha[ys, xs] = joint_bilateral(alpha, img, ys, xs, self.radius,
+                                            self.sigma_space, self.sigma_color)
+        return alpha
+
+    def __call__(self, img, prob):
+        """ Blend `img` (uint8, overwritten) with background by `prob`. """
+        return blend(img, self.get_background(img.shape[:2]),
+                     self.alpha(img, prob))
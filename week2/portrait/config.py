@@ -7,7 +7,12 @@ data_config = Config(
     batch_size = 16,
     img_height = 480, #after resize
     img_width = 400, # after resize
-    image_shape = (800, 600, 3) # original
+    image_shape = (800, 600, 3), # original
+    path_to_packed_masks = None, # e.g. './masks.npy' to pack all masks in one file
+    n_threads = 4, # threads decoding images of one batch
+    # paired image/mask augmentation of train set, None to switch off
+    augment = dict(rotation_range=15, zoom_range=0.1, shift_range=0.1,
+                   horizontal_flip=True),
 )
 
 train_config = Config(
@@ -19,7 +24,11 @@ train_config = Config(
     path_to_models = './models',
     epochs = 10,
     max_queue_size = 100,
-    workers = 1
+    workers = 1,
+    use_multiprocessing = False,
+    seed = 0, # data split, order and augmentation
+    debug_samples_per_epoch = 0, # images saved per epoch for debugging, 0 - off
+    path_to_debug_samples = './debug_samples'
 )
 
 config = Config(
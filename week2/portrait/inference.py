@@ -3,6 +3,8 @@ import argparse
 import fnmatch
 from shutil import copy
 import pdb
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import numpy as np
@@ -17,43 +19,170 @@ import scipy.misc
 
 import tools
 from config import config
+from tiling import TiledPredictor
+from composite import Compositor
 
 
-def get_mask(args, path_to_img):
-    model = load_model(args.path_to_model)
-    img = image.img_to_array(image.load_img(path_to_img,
-        target_size=[config.data.img_height, config.data.img_width]))
-    img = (img/255 - 0.5)*2
-    predict = model.predict(img[None, ...])[0]
-    print(predict.shape)
-    predict = predict[:, :, None] * np.ones(3, dtype=float)[None, None, :]
-    print(predict.shape)
-    predict = predict < 0.5
+class BackgroundReplacer:
+    """ Replace background of many portraits with one model and background.
+
+    Images are decoded and resized by a thread pool while previous batch
+    is predicted, composites are encoded and saved by a writer thread.
+
+    Args:
+        model: keras Model, portrait segmentation model
+        path_to_background: str, path to new background image
+        path_to_results: str, directory to save composites
+        batch_size: int, number of images in one forward pass
+        n_threads: int, number of threads decoding images
+        tiler: TiledPredictor, optional, predict masks at original
+            resolution by overlapping tiles
+    """
+
+    def __init__(self, model, path_to_background, path_to_results,
+                 batch_size=16, n_threads=4, tiler=None):
+        self.model = model
+        self.compositor = Compositor(image.load_img(path_to_background))
+        self.path_to_results = path_to_results
+        self.batch_size = batch_size
+        self.tiler = tiler
+        self.loader = ThreadPoolExecutor(n_threads)
+        self.writer = ThreadPoolExecutor(1)
+
+    def _load(self, path):
+        img = image.load_img(path)
+        net_input = img.resize((config.data.img_width, config.data.img_height))
+        return np.array(img, dtype=np.uint8), image.img_to_array(net_input)
+
+    def predict(self, originals, net_inputs):
+        """ Return foreground probabilities for batch of images. """
+        if self.tiler is not None:
+            return self.tiler.predict_many(originals)
+        net_inputs = (np.stack(net_inputs)/255 - 0.5)*2
+        return self.model.predict(net_inputs, batch_size=self.batch_size)
+
+    def composite(self, img, predict):
+        """ Blend uint8 `img` with background by foreground probability. """
+        return self.compositor(img, predict)
+
+    def _save(self, path_to_img, img, predict):
+        img = self.composite(img, predict)
+        path_to_save = os.path.join(self.path_to_results,
+                                    tools.get_file_name(path_to_img)+'.jpg')
+        scipy.misc.imsave(path_to_save, img)
 
+    def run(self, paths):
+        """ Replace background of all `paths`, return images per second. """
+        start = time.time()
+        batches = [paths[i:i+self.batch_size]
+                   for i in range(0, len(paths), self.batch_size)]
+        pending_loads = [self.loader.submit(self._load, p) for p in batches[0]] if batches else []
+        pending_writes = []
+        for i, batch in enumerate(batches):
+            loaded = [f.result() for f in pending_loads]
+            if i + 1 < len(batches):
+                pending_loads = [self.loader.submit(self._load, p)
+                                 for p in batches[i + 1]]
+            originals, net_inputs = zip(*loaded)
+            predicts = self.predict(list(originals), list(net_inputs))
+            # do not let writer fall behind more than one batch
+            for f in pending_writes:
+                f.result()
+            pending_writes = [self.writer.submit(self._save, *item)
+                              for item in zip(batch, originals, predicts)]
+        for f in pending_writes:
+            f.result()
+        elapsed = time.time() - start
+        speed = len(paths)/elapsed if elapsed else 0.
+        print('{} images in {:.1f} s, {:.2f} images/s'.format(
+            len(paths), elapsed, speed))
+        return speed
 
-    img = image.img_to_array(image.load_img(path_to_img))
-    original_size = img.shape[:2]
+class SequenceReplacer(BackgroundReplacer):
+    """ Replace background of frame sequence, like extracted video frames.
 
-    bali = image.img_to_array(image.load_img('./bali.jpg', target_size=config.data.image_shape[:2]))
+    Frames are streamed in order. A frame whose downscaled grey version
+    differs from the last predicted key frame by less than `diff_threshold`
+    (mean absolute difference, 0..255) reuses key frame mask instead of
+    running the network. Masks are smoothed in time by exponential moving
+    average with weight `smoothing` of the new mask.
+    """
 
-    img = scipy.misc.imresize(img, size=config.data.image_shape[:2])
-    img[predict] = bali[predict]
-    img = scipy.misc.imresize(img, size=original_size)
-    path_to_save = os.path.join(args.path_to_results,
-                                tools.get_file_name(path_to_img)+'.jpg')
-    print(path_to_save)
-    scipy.misc.imsave(path_to_save, img)
+    def __init__(self, *args, diff_threshold=2., smoothing=0.6, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.diff_threshold = diff_threshold
+        self.smoothing = smoothing
+        self.n_predicted = 0
+        self._key_thumb = None
+        self._key_predict = None
+        self._smoothed = None
+
+    @staticmethod
+    def _thumbnail(net_input):
+        return net_input[::8, ::8].mean(axis=-1)
+
+    def predict(self, originals, net_inputs):
+        # choose key frames which differ from previous key frame
+        key_of_frame = []
+        keys = []
+        for i, net_input in enumerate(net_inputs):
+            thumb = self._thumbnail(net_input)
+            if (self._key_thumb is None or
+                    np.abs(thumb - self._key_thumb).mean() > self.diff_threshold):
+                self._key_thumb = thumb
+                keys.append(i)
+            key_of_frame.append(len(keys) - 1)
+
+        if keys:
+            key_predicts = super().predict([originals[i] for i in keys],
+                                           [net_inputs[i] for i in keys])
+            self.n_predicted += len(keys)
+
+        predicts = []
+        for k in key_of_frame:
+            predict = self._key_predict if k < 0 else key_predicts[k]
+            if self._smoothed is None:
+                self._smoothed = predict
+            else:
+                self._smoothed = (self.smoothing*predict +
+                                  (1 - self.smoothing)*self._smoothed)
+            predicts.append(self._smoothed)
+        if keys:
+            self._key_predict = key_predicts[-1]
+        return predicts
+
+    def run(self, paths):
+        speed = super().run(paths)
+        print('network was run on {} of {} frames'.format(self.n_predicted,
+                                                          len(paths)))
+        return speed
 
 def main(args):
     os.makedirs(args.path_to_results, exist_ok=True)
     if os.path.isfile(args.path_to_img):
-        get_mask(args, args.path_to_img)
+        paths = [args.path_to_img]
     elif os.path.isdir(args.path_to_img):
-        for img in tools.find_files(args.path_to_img, '*.jpg'):
-            get_mask(args, img)
+        paths = tools.find_files(args.path_to_img, args.pattern)
     else:
         raise AttributeError('You should provide correct path to img')
 
+    model = load_model(args.path_to_model)
+    tiler = None
+    if args.tile:
+        tiler = TiledPredictor(model, args.tile_size, overlap=args.overlap,
+                               batch_size=args.batch_size)
+    if args.sequence:
+        replacer = SequenceReplacer(model, args.path_to_background,
+                                    args.path_to_results, args.batch_size,
+                                    args.n_threads, tiler,
+                                    diff_threshold=args.diff_threshold,
+                                    smoothing=args.smoothing)
+    else:
+        replacer = BackgroundReplacer(model, args.path_to_background,
+                                      args.path_to_results, args.batch_size,
+                                      args.n_threads, tiler)
+    replacer.run(paths)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -63,5 +192,27 @@ if __name__ == '__main__':
                         help="path to saved model")
     parser.add_argument('-path_to_results', type=str, default='./results',
                         help="path where results will be saved")
+    parser.add_argument('-path_to_background', type=str, default='./bali.jpg',
+                        help="path to new background image")
+    parser.add_argument('-n_threads', type=int, default=4,
+                        help="number of threads decoding images")
+    parser.add_argument('-pattern', type=str, default='*.jpg',
+                        help="pattern of image files in dir")
+    parser.add_argument('-sequence', action='store_true',
+                        help="treat sorted images as frames of one video")
+    parser.add_argument('-diff_threshold', type=float, default=2.,
+                        help="mean pixel difference to run network on a frame")
+    parser.add_argument('-smoothing', type=float, default=0.6,
+                        help="weight of new mask in temporal smoothing")
+    parser.add_argument('-tile', action='store_true',
+                        help="predict at original resolution by overlapping tiles")
+    parser.add_argument('-tile_size', type=int, nargs=2, default=None,
+                        metavar=('HEIGHT', 'WIDTH'),
+                        help="tile size, tiles are resized to model input, "
+                             "defaults to model input size")
+    parser.add_argument('-overlap', type=float, default=0.25,
+                        help="fraction of tile shared with neighbour tile")
+    parser.add_argument('-batch_size', type=int, default=16,
+                        help="number of tiles (or images) in one forward pass")
     args = parser.parse_args()
     main(args)
\ No newline at end of file
@@ -0,0 +1,122 @@
+import numpy as np
+from scipy import ndimage as nd
+
+
+def normilize(img):
+    return (img/255 - 0.5)*2
+
+def _tile_starts(length, tile, overlap):
+    """ Return start positions of tiles that cover `length` pixels. """
+    if length <= tile:
+        return [0]
+    stride = max(1, int(round(tile*(1 - overlap))))
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+def _blend_window(height, width):
+    """ Return 2D weights that fall off towards tile borders. """
+    wy = np.minimum(np.arange(1, height + 1), np.arange(height, 0, -1))
+    wx = np.minimum(np.arange(1, width + 1), np.arange(width, 0, -1))
+    return np.outer(wy, wx).astype(np.float32)
+
+
+class TiledPredictor:
+    """ Run a fixed input size segmentation model over images of any size.
+
+    Large images are split into overlapping tiles, tiles of all images are
+    predicted together in batches and logits of overlapping tiles are
+    blended with weights that fall off towards tile borders. Images smaller
+    than a tile are padded, so many small images share one forward pass.
+    Tiles of other size than the fixed model input are resized to it and
+    predictions are resized back, so larger tiles trade detail for speed.
+
+    Args:
+        model: keras Model with sigmoid output of shape
+            [batch, height, width] or [batch, height, width, n_classes]
+        tile_size: (height, width), defaults to model input size, required
+            for fully convolutional models
+        overlap: float, fraction of tile shared with neighbour tile
+        batch_size: int, number of tiles in one forward pass
+        output_index: int, which output to use for multi output models
+        preprocess: function applied to every tile before prediction
+    """
+
+    def __init__(self, model, tile_size=None, overlap=0.25, batch_size=16,
+                 output_index=0, preprocess=normilize):
+        self.model = model
+        self.input_size = tuple(model.input_shape[1:3])
+        self.tile_size = tuple(tile_size or self.input_size)
+        if None in self.tile_size:
+            raise ValueError('Model accepts any size, provide tile_size')
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.output_index = output_index
+        self.preprocess = preprocess
+        self.window = _blend_window(*self.tile_size)[:, :, None]
+
+    def _predict_tiles(self, tiles):
+        """ Return logits for tiles, resized to tile size. """
+        th, tw = self.tile_size
+        tiles = tiles.astype(np.float32)
+        ih, iw = self.input_size
+        if None not in self.input_size and (ih, iw) != (th, tw):
+            tiles = nd.zoom(tiles, [1, ih/th, iw/tw, 1], order=1)
+        pred = self.model.predict(self.preprocess(tiles),
+                                  batch_size=self.batch_size)
+        if isinstance(pred, list):
+            pred = pred[self.output_index]
+        if pred.ndim == 3:
+            pred = pred[..., None]
+        pred = np.clip(pred, 1e-6, 1 - 1e-6)
+        logits = np.log(pred/(1 - pred))
+        if logits.shape[1:3] != (th, tw):
+            zoom = [1, th/logits.shape[1], tw/logits.shape[2], 1]
+            logits = nd.zoom(logits, zoom, order=1)
+        return logits
+
+    def predict(self, img):
+        """ Return probability map with spatial size of `img`. """
+        return self.predict_many([img])[0]
+
+    def predict_many(self, imgs):
+        """ Return probability maps for list of images of any size.
+
+        Args:
+            imgs: list of np.array [height, width, 3] with values in 0..255
+
+        Returns:
+            list of np.array [height, width] or [height, width, n_classes]
+        """
+        th, tw = self.tile_size
+        padded = []
+        tiles = [] # (image index, y, x)
+        for i, img in enumerate(imgs):
+            h, w = img.shape[:2]
+            pad = ((0, max(th - h, 0)), (0, max(tw - w, 0)), (0, 0))
+            if any(p[1] for p in pad[:2]):
+                img = np.pad(img, pad, mode='edge')
+            padded.append(img)
+            tiles.extend((i, y, x)
+                         for y in _tile_starts(img.shape[0], th, self.overlap)
+                         for x in _tile_starts(img.shape[1], tw, self.overlap))
+
+        acc = [None]*len(imgs)
+        for s in range(0, len(tiles), self.batch_size):
+            batch = tiles[s:s + self.batch_size]
+            logits = self._predict_tiles(np.stack(
+                [padded[i][y:y + th, x:x + tw] for i, y, x in batch]))
+            for (i, y, x), l in zip(batch, logits):
+                if acc[i] is None:
+                    acc[i] = np.zeros(padded[i].shape[:2] + (l.shape[-1] + 1,),
+                                      dtype=np.float32)
+                acc[i][y:y + th, x:x + tw, :-1] += l*self.window
+                acc[i][y:y + th, x:x + tw, -1:] += self.window
+
+        results = []
+        for img, a in zip(imgs, acc):
+            h, w = img.shape[:2]
+            logits = a[:h, :w, :-1]/a[:h, :w, -1:]
+            prob = 1/(1 + np.exp(-logits))
+            results.append(prob[..., 0] if prob.shape[-1] == 1 else prob)
+        return results
@@ -1,7 +1,13 @@
 import os
+import sys
 import fnmatch
 import math
 from operator import itemgetter
+import queue
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from sklearn.model_selection import train_test_split
@@ -11,6 +17,12 @@ from keras.applications.vgg19 import preprocess_input
 from keras.preprocessing.image import (ImageDataGenerator, Iterator,
                                        array_to_img, img_to_array, load_img)
 
+# modules shared by all weeks live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from indexed_sequence import (IndexedSequence, SequenceCheckpoint,
+                              load_sequence_state, queue_size)
+from augmentation import PairedAugmenter
+
 
 def scaled_exp_decay(start: float, end: float, n_iter: int,
                current_iter: int) -> float:
@@ -150,45 +162,208 @@ def read_data(img_paths, masks_paths, config):
     train_masks = np.stack(train_masks)
     return train_x, train_masks
 
-def get_generators(config):
-    def except_catcher(gen):
+def normilize(img):
+    return (img/255 - 0.5)*2
+
+def pack_masks(masks_paths, path_to_pack):
+    """ Write all masks into one .npy file, that can be memory mapped.
+
+    Masks are copied one by one, so memory usage does not depend on
+    number of masks.
+    """
+    first = np.load(masks_paths[0], mmap_mode='r')
+    packed = np.lib.format.open_memmap(path_to_pack, mode='w+',
+                                       dtype=first.dtype,
+                                       shape=(len(masks_paths),) + first.shape)
+    for i, path in enumerate(masks_paths):
+        packed[i] = np.load(path, mmap_mode='r')
+    packed.flush()
+    del packed
+
+def load_masks(masks_paths, path_to_pack=None):
+    """ Return list of references to lazily loaded masks.
+
+    Args:
+        masks_paths: list of paths to .npy masks
+        path_to_pack: str, path to consolidated masks array,
+            created on first call. If None every mask is memory mapped
+            from its own file when requested.
+
+    Returns:
+        list of rows of consolidated masks array or paths to masks
+    """
+    if path_to_pack is None:
+        return list(masks_paths)
+    if not os.path.isfile(path_to_pack):
+        pack_masks(masks_paths, path_to_pack)
+    return list(range(len(masks_paths)))
+
+
+# epoch and number of saved images of every DebugSampler, created in the
+# main process and inherited by forked keras workers: key -> Array
+_sampler_budgets = {}
+_sampler_keys = itertools.count()
+# queue and writer thread of every DebugSampler in this process, keyed by
+# pid too, because threads of the parent are not running in forked workers:
+# (pid, key) -> (Queue, Thread)
+_sampler_writers = {}
+
+
+class DebugSampler:
+    """ Save a few yielded images per epoch from a background thread.
+
+    At most `n_per_epoch` images are queued per epoch, the rest are
+    dropped without copying, so training never waits for PNG encoding.
+    The budget lives in shared memory, so it holds for all keras worker
+    processes together, every process saves its images by its own thread.
+
+    Args:
+        save_to_dir: str, directory to save images
+        n_per_epoch: int, maximum number of saved images per epoch
+        prefix: str, file name prefix
+    """
+
+    def __init__(self, save_to_dir, n_per_epoch, prefix=''):
+        self.save_to_dir = save_to_dir
+        self.n_per_epoch = n_per_epoch
+        self.prefix = prefix
+        # only the key is pickled, shared array must be inherited
+        self._key = next(_sampler_keys)
+        _sampler_budgets[self._key] = multiprocessing.Array('i', 2) # epoch, count
+
+    def add(self, imgs, indexes):
+        """ Queue images of batch for saving while epoch budget allows. """
+        budget = _sampler_budgets[self._key]
+        with budget.get_lock():
+            epoch, count = budget[0], budget[1]
+            n = min(len(imgs), self.n_per_epoch - count)
+            if n <= 0:
+                return
+            budget[1] = count + n
+            writer = _sampler_writers.get((os.getpid(), self._key))
+            if writer is None:
+                os.makedirs(self.save_to_dir, exist_ok=True)
+                q = queue.Queue()
+                thread = threading.Thread(target=self._write, args=(q,), daemon=True)
+                thread.start()
+                writer = _sampler_writers[(os.getpid(), self._key)] = (q, thread)
+        for img, index in zip(imgs[:n], indexes[:n]):
+            writer[0].put((epoch, index, img.copy()))
+
+    def on_epoch_end(self, epoch=None, logs=None):
+        budget = _sampler_budgets[self._key]
+        with budget.get_lock():
+            budget[0] += 1
+            budget[1] = 0
+
+    def _write(self, q):
         while True:
-            try:
-                data = next(gen)
-                yield data
-            except Exception as e:
-                print('Ups! Something wrong!', e)
-    
-    def normilize(img):
-        return (img/255 - 0.5)*2
+            epoch, index, img = q.get()
+            fname = '{}epoch{}_{}.png'.format(self.prefix, epoch, index)
+            array_to_img(img, scale=True).save(os.path.join(self.save_to_dir, fname))
+
+
+class PortraitSequence(IndexedSequence):
+    """ Batches of portraits and masks read from disk on demand.
 
-    train_datagen = ImageDataGenerator(preprocessing_function=normilize)
+    Masks are memory mapped, images are decoded by a thread pool when
+    batch is requested. Keras enqueuer prefetches batches, so memory
+    usage is bounded by `max_queue_size` batches for any dataset size.
+    Consolidated masks array is memory mapped separately in every process.
 
-    test_datagen = ImageDataGenerator(preprocessing_function=normilize)
+    Args:
+        img_paths: list of paths to images
+        masks: list returned by `load_masks`, rows of
+            `config.data.path_to_packed_masks` or paths to .npy masks
+        config: config
+        n_threads: int, number of threads decoding images of one batch
+        sampler: DebugSampler, optional, saves some yielded images
+        augmenter: PairedAugmenter, optional, transforms images with masks
+        shuffle: bool, whether to permute samples every epoch
+        seed: int, random seed
+    """
 
+    def __init__(self, img_paths, masks, config, n_threads=4, sampler=None,
+                 augmenter=None, shuffle=True, seed=0):
+        super().__init__(len(img_paths), config.data.batch_size, seed, shuffle)
+        self.img_paths = img_paths
+        self.masks = masks
+        self.config = config
+        self.n_threads = n_threads
+        self.sampler = sampler
+        self.augmenter = augmenter
+        self._executor = None
+        self._packed = None
+
+    @property
+    def packed(self):
+        if self._packed is None:
+            self._packed = np.load(self.config.data.path_to_packed_masks,
+                                   mmap_mode='r')
+        return self._packed
+
+    def _load_img(self, path):
+        return image.img_to_array(image.load_img(path,
+            target_size=(self.config.data.img_height, self.config.data.img_width)))
+
+    def _load_mask(self, i):
+        mask = self.masks[i]
+        if isinstance(mask, str):
+            mask = np.load(mask, mmap_mode='r')
+        else:
+            mask = self.packed[mask]
+        return np.asarray(mask, dtype=np.float32)
+
+    def get_batch(self, inds, rng):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.n_threads)
+        imgs = list(self._executor.map(self._load_img,
+                                       [self.img_paths[i] for i in inds]))
+        batch_x = normilize(np.stack(imgs))
+        batch_y = np.stack([self._load_mask(i) for i in inds])
+        if self.augmenter is not None:
+            batch_x, batch_y = self.augmenter.transform(batch_x, batch_y, rng)
+        if self.sampler is not None:
+            self.sampler.add(batch_x, list(inds))
+        return batch_x, batch_y
+
+    def __getstate__(self):
+        # memory map would be pickled as full array
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_packed'] = None
+        return state
+
+def get_generators(config):
     img_paths = sorted(find_files(config.data.path_to_data, '*.jpg'))
     print(len(img_paths))
     masks_paths = sorted(find_files(config.data.path_to_masks, '*.npy'))
     print(len(masks_paths))
+    masks = load_masks(masks_paths, config.data.path_to_packed_masks)
     train_img_paths,\
     test_img_paths,\
-    train_masks_paths,\
-    test_masks_paths = train_test_split(img_paths, masks_paths,
-                                        test_size=config.data.test_size)
-
-    train_x, train_masks = read_data(train_img_paths, train_masks_paths, config)
-    test_x, test_masks = read_data(test_img_paths, test_masks_paths, config)
-
-    train_generator = train_datagen.flow(
-        x=train_x,
-        y=train_masks,
-        batch_size=config.data.batch_size,
-        save_to_dir='./save_to_dir_train')
-
-    validation_generator = test_datagen.flow(
-        x=test_x,
-        y=test_masks,
-        batch_size=config.data.batch_size,
-        save_to_dir='./save_to_dir_test')
+    train_masks,\
+    test_masks = train_test_split(img_paths, masks,
+                                  test_size=config.data.test_size,
+                                  random_state=config.train.seed)
+
+    train_sampler, test_sampler = None, None
+    if config.train.debug_samples_per_epoch:
+        train_sampler = DebugSampler(config.train.path_to_debug_samples,
+                                     config.train.debug_samples_per_epoch, 'train_')
+        test_sampler = DebugSampler(config.train.path_to_debug_samples,
+                                    config.train.debug_samples_per_epoch, 'test_')
+
+    augmenter = None
+    if config.data.augment:
+        augmenter = PairedAugmenter(**config.data.augment)
+
+    train_generator = PortraitSequence(train_img_paths, train_masks, config,
+                                       config.data.n_threads, train_sampler,
+                                       augmenter, seed=config.train.seed)
+
+    validation_generator = PortraitSequence(test_img_paths, test_masks, config,
+                                            config.data.n_threads, test_sampler,
+                                            shuffle=False, seed=config.train.seed)
 
     return train_generator, validation_generator
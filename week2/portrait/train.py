@@ -7,6 +7,7 @@ from keras.applications.resnet50 import ResNet50
 from keras.models import Model
 from keras.callbacks import EarlyStopping, ProgbarLogger, ModelCheckpoint
 from keras.callbacks import LearningRateScheduler, CSVLogger, TensorBoard
+from keras.callbacks import LambdaCallback
 from keras.layers import Dense, GlobalAveragePooling2D, Input, Flatten
 from keras.optimizers import Adam
 from keras.models import load_model
@@ -33,11 +34,17 @@ call_backs =[
     ModelCheckpoint(config.train.path_to_models+'/model', save_best_only=True),
     LearningRateScheduler(lambda x: tools.lr_scheduler(x, config)),
     CSVLogger(config.train.path_to_log),
-    TensorBoard(config.train.path_to_summaries)
+    TensorBoard(config.train.path_to_summaries),
+    tools.SequenceCheckpoint(train_gen)
     ]
-
-steps_per_epoch=int((1-config.data.test_size)*1700/config.data.batch_size) // 1
-validation_steps=int(config.data.test_size*1700/config.data.batch_size) // 1
+for gen in (train_gen, test_gen):
+    if gen.sampler is not None:
+        call_backs.append(LambdaCallback(on_epoch_end=gen.sampler.on_epoch_end))
+
+steps_per_epoch=len(train_gen)
+validation_steps=len(test_gen)
+# prefetched batches must stay in one sweep over the train sequence
+max_queue_size=tools.queue_size(train_gen, config.train.max_queue_size)
 model.fit_generator(generator=train_gen,
                     steps_per_epoch=steps_per_epoch,
                     epochs=config.train.epochs,
@@ -45,6 +52,6 @@ model.fit_generator(generator=train_gen,
                     callbacks=call_backs,
                     validation_data=test_gen,
                     validation_steps=validation_steps,
-                    max_queue_size=config.train.max_queue_size,
+                    max_queue_size=max_queue_size,
                     workers=config.train.workers,
-                    use_multiprocessing=False)
\ No newline at end of file
+                    use_multiprocessing=config.train.use_multiprocessing)
\ No newline at end of file
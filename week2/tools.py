@@ -1,7 +1,12 @@
 import os
+import sys
 import fnmatch
 import math
 import random
+import queue
+import threading
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 from operator import itemgetter
 from collections import defaultdict
 from functools import partial
@@ -13,6 +18,11 @@ from scipy.misc import imresize
 from keras import backend as K
 import tensorflow as tf
 
+# modules shared by all weeks live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indexed_sequence import (IndexedSequence, SequenceCheckpoint,
+                              load_sequence_state, queue_size)
+from augmentation import PairedAugmenter
 
 
 def scaled_exp_decay(start: float, end: float, n_iter: int,
@@ -163,90 +173,482 @@ def generator(coco, c, path_to_imgs):
         random.shuffle(img_ids)
         X = get_imgs_by_ids(img_ids[:c.batch_size], coco, c, path_to_imgs)
         Y = get_targets_by_ids(img_ids[:c.batch_size], coco, c, cat_to_class_map)
-        Y = Y.astype(np.uint8)
-        Y_normal = (Y > 0.5).astype(np.uint8)
-        X = X.astype(np.float32)
-        yield (X, {'normal_output': Y_normal, 'multiobject_output': Y})
-    
+        yield make_batch(X, Y)
+
+def make_batch(X, Y):
+    """ Pack images and multiobject targets into keras inputs/outputs. """
+    Y = Y.astype(np.uint8)
+    Y_normal = (Y > 0.5).astype(np.uint8)
+    X = X.astype(np.float32)
+    return (X, {'normal_output': Y_normal, 'multiobject_output': Y})
+
+def load_coco_img(img, c, path_to_imgs, size=None):
+    """ Load and normalize one image described by coco `img` dict.
+
+    Args:
+        size: (height, width) to resize to, defaults to config size
+    """
+    size = size or (c.img_height, c.img_width)
+    path = os.path.join(path_to_imgs, img['file_name'])
+    return image.img_to_array(image.load_img(path,
+        target_size=list(size)))/127.5 - 1
+
+def get_target_by_id(id_, coco, c, cat_to_class_map, multiobject_segmentation=True,
+                     size=None):
+    """ Return target for one image as array height x width x n_classes. """
+    size = size or (c.img_height, c.img_width)
+    Y = np.zeros((size[0], size[1], c.n_classes), dtype=np.float)
+    what_class_was_used = defaultdict(int)
+    for ann in coco.imgToAnns[id_]:
+        i = cat_to_class_map[ann['category_id']]
+        what_class_was_used[i] += 1
+        mask = imresize(coco.annToMask(ann), list(size))
+        mask = (mask > 0).astype(float)
+        if multiobject_segmentation:
+            mask *= what_class_was_used[i]
+        Y[:, :, i] += mask
+    return Y
 
 def get_imgs_by_ids(img_ids, coco, c, path_to_imgs):
     """ Get list of img ids and return batch of images. """
     imgs = coco.loadImgs(img_ids)
-    X = np.empty((c.batch_size, c.img_height, c.img_width, 3), dtype=np.float)
+    X = np.empty((len(img_ids), c.img_height, c.img_width, 3), dtype=np.float)
     for i, img in enumerate(imgs):
-        path = os.path.join(path_to_imgs, img['file_name'])
-        X[i] = image.img_to_array(image.load_img(path,
-            target_size=[c.img_height, c.img_width]))/127.5 - 1
+        X[i] = load_coco_img(img, c, path_to_imgs)
     return X
 
 def get_targets_by_ids(img_ids, coco, c, cat_to_class_map, multiobject_segmentation=True):
     """ Return targets as array batch_size x height x width x n_channels. """
-    Y = np.zeros((c.batch_size, c.img_height, c.img_width, c.n_classes),
+    Y = np.zeros((len(img_ids), c.img_height, c.img_width, c.n_classes),
                     dtype=np.float)
     for b, id_ in enumerate(img_ids):
-        anns = coco.imgToAnns[id_]
-        what_class_was_used = defaultdict(int)
-        for ann in anns:
-            i = cat_to_class_map[ann['category_id']]
-            what_class_was_used[i] += 1
-            mask = imresize(coco.annToMask(ann), [c.img_height, c.img_width])
-            mask = (mask > 0).astype(float)
-            if multiobject_segmentation:
-                mask *= what_class_was_used[i]
-            Y[b, :, :, i] += mask
+        Y[b] = get_target_by_id(id_, coco, c, cat_to_class_map,
+                                multiobject_segmentation)
     # Y = (Y > 0).astype(np.uint8)
     return Y
 
+def fill_sample(X, Y, b, img_id, size, coco, c, path_to_imgs, cat_to_class_map):
+    """ Write image and target of `img_id` with `size` into row `b` of X, Y.
+
+    Rows are zero padded when batch is larger than the image.
+    """
+    h, w = size
+    img = coco.loadImgs([img_id])[0]
+    X[b] = 0
+    Y[b] = 0
+    X[b, :h, :w] = load_coco_img(img, c, path_to_imgs, size)
+    Y[b, :h, :w] = get_target_by_id(img_id, coco, c, cat_to_class_map,
+                                    size=size)
+
+
+# COCO instances of this process: path to json -> COCO
+_cocos = {}
+
+def get_coco(path_to_json):
+    """ Return COCO of `path_to_json`, parsed once per process.
+
+    Worker processes forked after the first call share parsed annotations.
+    """
+    if path_to_json not in _cocos:
+        _cocos[path_to_json] = COCO(path_to_json)
+    return _cocos[path_to_json]
+
+# state of loader processes, filled once per process by `_init_loader`
+_loader = {}
+
+def _init_loader(path_to_json, c, path_to_imgs, cat_to_class_map, x_bufs, y_bufs):
+    _loader.update(coco=get_coco(path_to_json), c=c, path_to_imgs=path_to_imgs,
+                   cat_to_class_map=cat_to_class_map,
+                   x_bufs=x_bufs, y_bufs=y_bufs)
+
+def _buffer_views(x_buf, y_buf, shape, n_classes):
+    """ Return X, Y arrays of batch `shape` (n, height, width) over buffers. """
+    n, h, w = shape
+    X = np.frombuffer(x_buf, dtype=np.float32, count=n*h*w*3)
+    Y = np.frombuffer(y_buf, dtype=np.uint8, count=n*h*w*n_classes)
+    return X.reshape(n, h, w, 3), Y.reshape(n, h, w, n_classes)
+
+def _load_sample(task):
+    """ Build one sample and write it into shared buffers `buf`. """
+    buf, b, img_id, size, shape = task
+    c = _loader['c']
+    X, Y = _buffer_views(_loader['x_bufs'][buf], _loader['y_bufs'][buf], shape,
+                         c.n_classes)
+    fill_sample(X, Y, b, img_id, size, _loader['coco'], c,
+                _loader['path_to_imgs'], _loader['cat_to_class_map'])
+
+
+class CocoSequence(IndexedSequence):
+    """ Indexable batches of COCO images and targets.
+
+    Every batch depends only on its index, so the sequence can be shared
+    by keras workers (threads or processes). With `n_loaders` > 0 the
+    samples of a batch are decoded and rasterized by a process pool,
+    which writes them straight into shared memory. Every request gets its
+    own buffer, so batches requested by several keras worker threads are
+    loaded at once and `workers*batch_size` samples keep the pool busy.
+
+    Only the path to annotations is pickled with the sequence, COCO is
+    parsed once per process by `get_coco`.
+
+    Args:
+        path_to_json: str, coco annotations
+        c: config
+        path_to_imgs: str, directory with images
+        n_loaders: int, number of loader processes, 0 to load in place
+        shuffle: bool, whether to permute images every epoch
+        augmenter: PairedAugmenter, optional, transforms images with targets
+        seed: int, random seed
+    """
+
+    # whether targets have padding mask channel
+    masked = False
+
+    def __init__(self, path_to_json, c, path_to_imgs, n_loaders=0, shuffle=True,
+                 augmenter=None, seed=0):
+        self.path_to_json = path_to_json
+        coco = self.coco
+        self.img_ids = coco.getImgIds()
+        super().__init__(len(self.img_ids), c.batch_size, seed, shuffle)
+        self.c = c
+        self.path_to_imgs = path_to_imgs
+        self.n_loaders = n_loaders
+        self.augmenter = augmenter
+        self.cat_to_class_map = {cat: i for i, cat in
+                                 enumerate(coco.getCatIds())}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def coco(self):
+        return get_coco(self.path_to_json)
+
+    def sample_sizes(self, img_ids):
+        """ Return (height, width) every image is resized to. """
+        return [(self.c.img_height, self.c.img_width)]*len(img_ids)
+
+    def batch_shape(self, sizes):
+        """ Return (n, height, width) of batch with images of `sizes`. """
+        return (len(sizes), self.c.img_height, self.c.img_width)
+
+    def max_shape(self):
+        """ Return largest (height, width) of any batch. """
+        return (self.c.img_height, self.c.img_width)
+
+    def valid_mask(self, sizes, shape):
+        """ Return uint8 array `shape`, 1 on image pixels and 0 on padding. """
+        valid = np.zeros(shape, dtype=np.uint8)
+        for b, (h, w) in enumerate(sizes):
+            valid[b, :h, :w] = 1
+        return valid
+
+    def get_batch(self, indexes, rng):
+        img_ids = [self.img_ids[i] for i in indexes]
+        sizes = self.sample_sizes(img_ids)
+        shape = self.batch_shape(sizes)
+        # pool processes can not be started from daemonic keras workers
+        if self.n_loaders and not multiprocessing.current_process().daemon:
+            X, Y = self._load_parallel(img_ids, sizes, shape)
+        else:
+            X = np.empty(shape + (3,), dtype=np.float32)
+            Y = np.empty(shape + (self.c.n_classes,), dtype=np.uint8)
+            for b, (img_id, size) in enumerate(zip(img_ids, sizes)):
+                fill_sample(X, Y, b, img_id, size, self.coco, self.c,
+                            self.path_to_imgs, self.cat_to_class_map)
+        if self.masked:
+            # padding mask goes as the last target channel to masked losses,
+            # augmenter moves it together with the targets
+            Y = np.concatenate([Y, self.valid_mask(sizes, shape)[..., None]], -1)
+        if self.augmenter is not None:
+            X, Y = self.augmenter.transform(X, Y, rng)
+        return make_batch(X, Y)
+
+    def _start_pool(self):
+        """ Start loader processes with one pair of shared buffers per
+        concurrent request, at most `n_loaders` requests are served at once. """
+        c = self.c
+        h, w = self.max_shape()
+        x_bufs = [RawArray('f', c.batch_size*h*w*3) for _ in range(self.n_loaders)]
+        y_bufs = [RawArray('B', c.batch_size*h*w*c.n_classes)
+                  for _ in range(self.n_loaders)]
+        self._bufs = (x_bufs, y_bufs)
+        self._free = queue.Queue()
+        for buf in range(self.n_loaders):
+            self._free.put(buf)
+        self._pool = multiprocessing.Pool(
+            self.n_loaders, initializer=_init_loader,
+            initargs=(self.path_to_json, c, self.path_to_imgs,
+                      self.cat_to_class_map, x_bufs, y_bufs))
+
+    def _load_parallel(self, img_ids, sizes, shape):
+        with self._lock:
+            if self._pool is None:
+                self._start_pool()
+        buf = self._free.get()
+        try:
+            self._pool.map(_load_sample, [(buf, b, img_id, size, shape)
+                                          for b, (img_id, size)
+                                          in enumerate(zip(img_ids, sizes))])
+            X, Y = _buffer_views(self._bufs[0][buf], self._bufs[1][buf], shape,
+                                 self.c.n_classes)
+            return X.copy(), Y.copy()
+        finally:
+            self._free.put(buf)
+
+    def close(self):
+        """ Stop loader processes. """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def __getstate__(self):
+        # pool, lock and shared buffers stay in the process that made them
+        state = self.__dict__.copy()
+        for key in ('_pool', '_lock', '_bufs', '_free'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = None
+        self._lock = threading.Lock()
+
+
+def _round_up(x, multiple):
+    return int(math.ceil(x / multiple)) * multiple
+
+# image sizes and aspect ratio buckets of this process:
+# (path to json, max side, number of buckets) -> (sizes, buckets)
+_bucketings = {}
+
+def get_bucketing(path_to_json, max_side, n_buckets):
+    """ Return image sizes and aspect ratio buckets, computed once per process.
+
+    Returns:
+        sizes: dict, image id -> (height, width) scaled to `max_side`
+        buckets: list of lists of sample indexes (positions in
+            `coco.getImgIds()`) of images with similar aspect ratio
+    """
+    key = (path_to_json, max_side, n_buckets)
+    if key not in _bucketings:
+        coco = get_coco(path_to_json)
+        img_ids = coco.getImgIds()
+        sizes = {}
+        for img in coco.loadImgs(img_ids):
+            scale = min(1, max_side / max(img['height'], img['width']))
+            sizes[img['id']] = (int(round(img['height']*scale)),
+                                int(round(img['width']*scale)))
+
+        ratios = np.log([sizes[i][1] / sizes[i][0] for i in img_ids])
+        edges = np.linspace(np.log(1/2), np.log(2), n_buckets - 1)
+        buckets = defaultdict(list)
+        for i, bucket in enumerate(np.digitize(ratios, edges)):
+            buckets[bucket].append(i)
+        _bucketings[key] = (sizes, [buckets[bucket] for bucket in sorted(buckets)])
+    return _bucketings[key]
+
+class BucketSequence(CocoSequence):
+    """ COCO batches of images with similar aspect ratio at native resolution.
+
+    Images are scaled down only if their longer side exceeds `c.max_side`.
+    Every image goes to one of `c.n_buckets` aspect ratio buckets and a
+    batch is built from one bucket, so padding (up to a multiple of
+    `c.size_multiple`) stays small. Batches are composed anew every epoch.
+    Targets get the padding mask as the last channel, so losses must be
+    made with `masked=True`. Needs fully convolutional VGGUnet.
+
+    Like COCO, sizes and buckets are not pickled, every process computes
+    them once by `get_bucketing`.
+    """
+
+    masked = True
+
+    def __init__(self, path_to_json, c, path_to_imgs, n_loaders=0, shuffle=True,
+                 augmenter=None, seed=0):
+        super().__init__(path_to_json, c, path_to_imgs, n_loaders, shuffle,
+                         augmenter, seed)
+        # number of batches does not depend on composition
+        self._n_batches = sum(int(math.ceil(len(inds) / c.batch_size))
+                              for inds in self.buckets)
+        self._batches = (None, None) # (epoch, batches)
+
+    @property
+    def sizes(self):
+        return get_bucketing(self.path_to_json, self.c.max_side,
+                             self.c.n_buckets)[0]
+
+    @property
+    def buckets(self):
+        return get_bucketing(self.path_to_json, self.c.max_side,
+                             self.c.n_buckets)[1]
+
+    def __len__(self):
+        return self._n_batches
+
+    def epoch_batches(self, epoch):
+        """ Return sample indexes of all batches of `epoch` in order. """
+        cached_epoch, batches = self._batches
+        if cached_epoch == epoch:
+            return batches
+        rng = np.random.RandomState([self.seed, epoch])
+        batches = []
+        for inds in self.buckets:
+            if self.shuffle:
+                inds = [inds[i] for i in rng.permutation(len(inds))]
+            batches.extend(inds[i:i + self.batch_size]
+                           for i in range(0, len(inds), self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        self._batches = (epoch, batches)
+        return batches
+
+    def batch_indexes(self, idx):
+        epoch, cursor = self.position(idx)
+        return self.epoch_batches(epoch)[cursor]
+
+    def sample_sizes(self, img_ids):
+        return [self.sizes[img_id] for img_id in img_ids]
+
+    def batch_shape(self, sizes):
+        m = self.c.size_multiple
+        return (len(sizes),
+                _round_up(max(h for h, _ in sizes), m),
+                _round_up(max(w for _, w in sizes), m))
+
+    def max_shape(self):
+        side = _round_up(self.c.max_side, self.c.size_multiple)
+        return (side, side)
+
+    def __getstate__(self):
+        # batches of an epoch are composed again by every process
+        state = super().__getstate__()
+        state['_batches'] = (None, None)
+        return state
+
 def get_generators(c):
-    train_coco = COCO(c.path_to_train_json)
-    test_coco = COCO(c.path_to_test_json)
-    
-    train_gen = generator(train_coco, c, c.path_to_train_imgs)
-    test_gen = generator(test_coco, c, c.path_to_test_imgs)
+    sequence = BucketSequence if c.bucketing else CocoSequence
+    augmenter = PairedAugmenter(**c.augment) if c.augment else None
+    train_gen = sequence(c.path_to_train_json, c, c.path_to_train_imgs,
+                         c.n_loaders, augmenter=augmenter, seed=c.seed)
+    test_gen = sequence(c.path_to_test_json, c, c.path_to_test_imgs,
+                        c.n_loaders, shuffle=False, seed=c.seed)
     return train_gen, test_gen
 
-def get_class_distrib(c):
-    cocodata = COCO(c.path_to_train_json)
-    cat_to_class_map = {cat: i for i, cat in enumerate(cocodata.getCatIds())}
-    img_ids = list(cocodata.imgs.keys()) #cocodata.getImgIds()
-    cat_distr = defaultdict(int)
-    for img_id in img_ids:
-        anns = cocodata.imgToAnns[img_id]
-        cats = np.array([ann['category_id'] for ann in anns])
-        for cat in  set(list(cats)):
-            cat_distr[cat] += np.sum(cats == cat)
-    cat_distr = {cat_to_class_map[cat]:n for cat, n in cat_distr.items()}
-    cat_distr = {k:max(cat_distr.values())/v for k, v in cat_distr.items()}
-    class_distr = np.array([cat_distr[cat] for cat in sorted(cat_distr.keys())])
+def get_class_stats(coco, n_classes, path_to_cache=None):
+    """ Collect per-class statistics over all annotations of a dataset.
+
+    All category ids are gathered into one flat array, so counting is done
+    by a single `np.bincount` instead of a loop over images.
+
+    Args:
+        coco: COCO instance
+        n_classes: int, number of classes in dataset
+        path_to_cache: str, where to store/load computed statistics
+
+    Returns:
+        dict with
+            counts: np.array [n_classes], number of instances per class
+            areas: np.array [n_classes], total pixel area per class
+            img_counts: np.array [n_classes], number of images with class
+            cooccurrence: np.array [n_classes, n_classes], number of images
+                where both classes are present
+    """
+    keys = {'counts', 'areas', 'img_counts', 'cooccurrence'}
+    if path_to_cache and os.path.isfile(path_to_cache):
+        stats = dict(np.load(path_to_cache))
+        if set(stats) == keys:
+            return stats
+
+    anns = coco.dataset['annotations']
+    cat_ids = np.array([ann['category_id'] for ann in anns], dtype=np.int64)
+    areas = np.array([ann['area'] for ann in anns], dtype=np.float64)
+    ann_img_ids = np.array([ann['image_id'] for ann in anns], dtype=np.int64)
+
+    # map coco category ids (with gaps) to contiguous class indexes
+    cat_to_class = np.zeros(max(coco.getCatIds()) + 1, dtype=np.int64)
+    cat_to_class[coco.getCatIds()] = np.arange(len(coco.getCatIds()))
+    classes = cat_to_class[cat_ids]
+
+    _, img_index = np.unique(ann_img_ids, return_inverse=True)
+    presence = np.zeros((img_index.max() + 1 if len(img_index) else 0,
+                         n_classes), dtype=np.float32)
+    presence[img_index, classes] = 1
+
+    stats = {
+        'counts': np.bincount(classes, minlength=n_classes),
+        'areas': np.bincount(classes, weights=areas, minlength=n_classes),
+        'img_counts': presence.sum(axis=0).astype(np.int64),
+        'cooccurrence': presence.T.dot(presence).astype(np.int64)}
+
+    if path_to_cache:
+        np.savez(path_to_cache, **stats)
+    return stats
+
+def get_class_distrib(c, coco, by='count'):
+    """ Return class weights for weighted loss.
+
+    Args:
+        c: config
+        coco: COCO instance of train set, only read when statistics
+            are not cached yet
+        by: str, 'count' to weight by number of instances,
+            'area' to weight by number of pixels per class,
+            'images' to weight by number of images with class,
+            'cooccurrence' to weight by number of images with class
+            divided by mean number of classes in these images, so classes
+            seen only in crowded scenes get larger weights
+
+    Returns:
+        np.array [n_classes], max(stat)/stat for every class
+    """
+    path_to_cache = '{}_class_stats_{}.npz'.format(
+        os.path.splitext(c.path_to_train_json)[0], c.n_classes)
+    stats = get_class_stats(coco, c.n_classes, path_to_cache)
+    img_counts = stats['img_counts'].astype(np.float64)
+    # row sum is number of (image, other class) pairs over images with class
+    classes_per_img = stats['cooccurrence'].sum(axis=1) / np.maximum(img_counts, 1)
+    distr = {'count': stats['counts'], 'area': stats['areas'],
+             'images': img_counts,
+             'cooccurrence': img_counts / np.maximum(classes_per_img, 1)}[by]
+    distr = distr.astype(np.float64)
+    class_distr = distr.max() / np.maximum(distr, 1)
     print('class distrib\n', class_distr)
     return class_distr
 
-def weighted_loss(y_true, y_pred, weights):
+def weighted_loss(y_true, y_pred, weights, masked=False):
     """ Return weighted sum of crossentropy loss. 
 
     Args:
         y_true: np.array, shape = [batch, height, width. n_classes]
         y_pred: np.array, shape = [batch, height, width. n_classes]
         weights: np.array with class weights, shape = [n_classes]
+        masked: bool, whether last channel of y_true is padding mask,
+            padded pixels are left out of the loss
 
     Reurn:
         cost: float
     """ 
     n_classes = len(weights)
+    if masked:
+        valid = K.reshape(y_true[:, :, :, -1], shape=[-1, 1])
+        y_true = y_true[:, :, :, :-1]
     y_true = K.reshape(y_true, shape=[-1, n_classes])
     y_pred = K.reshape(y_pred, shape=[-1, n_classes])
-    cost = K.mean(K.binary_crossentropy(y_true, y_pred)*weights)
-    return cost
+    cost = K.binary_crossentropy(y_true, y_pred)*weights
+    if masked:
+        return K.sum(cost*valid)/(K.sum(valid)*n_classes + K.epsilon())
+    return K.mean(cost)
 
-def get_weighted_loss_keras(weights):
-    return partial(weighted_loss, weights=weights)
+def get_weighted_loss_keras(weights, masked=False):
+    return partial(weighted_loss, weights=weights, masked=masked)
 
-def multiobject_segmentation_loss(y_true, y_pred, n_classes, n_obj):
+def multiobject_segmentation_loss(y_true, y_pred, n_classes, n_obj, masked=False):
     """ Compute my specific loss for object segmentation and detection. 
     
     Args:
         n_classes: int, number of classes in dataset
         n_obj: int, maximum number of object on one layer(class)
+        masked: bool, whether last channel of y_true is padding mask
     """
     def pairwase_MSE(x):
         x1 = tf.expand_dims(x, 0)
@@ -264,6 +666,7 @@ def multiobject_segmentation_loss(y_true, y_pred, n_classes, n_obj):
         n = tf.reduce_sum(mask)
         return tf.reduce_sum(tf.square(x - mean))/(n+1e-8)
 
+    valid = y_true[:, :, :, -1] if masked else 1.
     loss = 0
     for layer in range(n_classes):
         y_t = y_true[:, :, :, layer]
@@ -271,7 +674,7 @@ def multiobject_segmentation_loss(y_true, y_pred, n_classes, n_obj):
         mean_list = []
         d_list = []
         for obj in range(n_obj):
-            mask = tf.cast(tf.equal(y_t, obj), tf.float32) # b x h x w
+            mask = tf.cast(tf.equal(y_t, obj), tf.float32)*valid # b x h x w
             mean_list.append(masked_mean(y_p, mask))
             d_list.append(masked_dispersion(y_p, mask))
         mean = tf.convert_to_tensor(mean_list)
@@ -283,5 +686,6 @@ def multiobject_segmentation_loss(y_true, y_pred, n_classes, n_obj):
         loss += tf.reduce_sum(d)
     return loss
 
-def multiobject_segmentation_loss_keras(n_classes, n_obj):
-    return partial(multiobject_segmentation_loss, n_classes=n_classes, n_obj=n_obj)
\ No newline at end of file
+def multiobject_segmentation_loss_keras(n_classes, n_obj, masked=False):
+    return partial(multiobject_segmentation_loss, n_classes=n_classes, n_obj=n_obj,
+                   masked=masked)
\ No newline at end of file
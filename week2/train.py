@@ -14,33 +14,42 @@ import numpy as np
 
 from config import config as c
 import tools
-from vggUnet import VGGUnet
+from vggUnet import get_unet
 
 def get_model():
     if os.path.isfile(c.path_to_models+'/model'):
+        # keeps optimizer state, so training continues as if never stopped
         model = load_model(c.path_to_models+'/model',
                         custom_objects={'weighted_loss_func': weighted_loss_func,
                                         'multiobject_segmentation': multiobject_segmentation})
         print('model is loaded')
     else:
-        model = VGGUnet(c)
+        model = get_unet(c, fully_conv=c.bucketing)
+        model.compile(
+            optimizer=Adam(),
+            loss={'normal_output':weighted_loss_func,
+                  'multiobject_output':multiobject_segmentation})
     return model
 
 train_gen, val_gen = tools.get_generators(c)
 
-class_weight = tools.get_class_distrib(c)
-weighted_loss_func = tools.get_weighted_loss_keras(class_weight)
+class_weight = tools.get_class_distrib(c, train_gen.coco, by=c.class_weight_by)
+# bucketed batches are padded, padding is masked out of the losses
+weighted_loss_func = tools.get_weighted_loss_keras(class_weight, masked=c.bucketing)
 weighted_loss_func.__name__ ='weighted_loss_func'
 
-multiobject_segmentation = tools.multiobject_segmentation_loss_keras(c.n_classes, c.n_obj)
+multiobject_segmentation = tools.multiobject_segmentation_loss_keras(
+    c.n_classes, c.n_obj, masked=c.bucketing)
 multiobject_segmentation.__name__ ='multiobject_segmentation'
 
 model = get_model()
 
-model.compile(
-    optimizer=Adam(),
-    loss={'normal_output':weighted_loss_func,
-          'multiobject_output':multiobject_segmentation})
+# continue data pipeline from the position saved with the model
+initial_epoch = 0
+state = tools.load_sequence_state(c.path_to_models+'/model')
+if state is not None:
+    train_gen.set_state(state)
+    initial_epoch = state['train_epoch']
 
 os.makedirs(c.path_to_summaries, exist_ok=True)
 os.makedirs(c.path_to_models, exist_ok=True)
@@ -51,7 +60,9 @@ call_backs =[
     # ModelCheckpoint(c.path_to_models+'/model', save_best_only=True),
     # LearningRateScheduler(lambda x: tools.lr_scheduler(x, c)),
     # CSVLogger(c.path_to_log),
-    TensorBoard(c.path_to_summaries)
+    TensorBoard(c.path_to_summaries),
+    tools.SequenceCheckpoint(train_gen, c.path_to_models+'/model',
+                             c.checkpoint_period)
     ]
 
 
@@ -62,6 +73,7 @@ model.fit_generator(generator=train_gen,
                     callbacks=call_backs,
                     # validation_data=val_gen,
                     # validation_steps=1,
-                    max_queue_size=c.max_queue_size,
-                    workers=c.workers)
-model.save(c.path_to_models+'/model')
\ No newline at end of file
+                    max_queue_size=tools.queue_size(train_gen, c.max_queue_size),
+                    workers=c.workers,
+                    use_multiprocessing=c.use_multiprocessing,
+                    initial_epoch=initial_epoch)
\ No newline at end of file
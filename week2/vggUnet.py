@@ -1,17 +1,98 @@
+import os
+import json
+import inspect
+import hashlib
+
 from keras.models import *
 from keras.layers import *
 from keras.utils.data_utils import get_file
 
 WEIGHTS_PATH_NO_TOP = 'https://github.com/fchollet/deep-learning-models/releases/download/v0.1/vgg19_weights_tf_dim_ordering_tf_kernels_notop.h5'
 
+# known pretrained weights: name -> file name, origin and md5 checksum
+WEIGHTS = {
+    'vgg19_notop': {
+        'fname': 'vgg19_weights_tf_dim_ordering_tf_kernels_notop.h5',
+        'origin': WEIGHTS_PATH_NO_TOP,
+        'md5': '253f8cb515780f3b799900260a226db6'},
+}
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.keras', 'models')
+
+# files already checked in this process: path -> mtime
+_verified = {}
+
+
+def _md5(path, chunk_size=2**20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def get_weights(name, cache_dir=None, offline=False):
+    """ Return path to a verified local copy of registered weights.
+
+    Args:
+        name: str, key of WEIGHTS registry
+        cache_dir: str, directory with weight files, defaults to ~/.keras/models
+        offline: bool, never download, fail if file is missing
+
+    Returns:
+        str, path to weights file
+    """
+    entry = WEIGHTS[name]
+    cache_dir = os.path.abspath(cache_dir or DEFAULT_CACHE_DIR)
+    path = os.path.join(cache_dir, entry['fname'])
+    if not os.path.isfile(path):
+        if offline:
+            raise IOError('Weights {} are not found in {}. Copy {} there '
+                          'or disable offline mode.'.format(
+                              name, cache_dir, entry['origin']))
+        path = get_file(entry['fname'], entry['origin'],
+                        md5_hash=entry['md5'], cache_subdir=cache_dir)
+    mtime = os.path.getmtime(path)
+    if _verified.get(path) != mtime:
+        if _md5(path) != entry['md5']:
+            raise IOError('Checksum mismatch for {}. Remove the file and '
+                          'download it again.'.format(path))
+        _verified[path] = mtime
+    return path
+
 def Interp(x, shape):
     from keras.backend import tf as ktf
     new_height, new_width = shape
     resized = ktf.image.resize_images(x, [new_height, new_width], align_corners=True)
     return resized
 
-def VGGUnet(c):
-    img_input = Input(shape=(c.img_height, c.img_width, 3))
+def InterpLike(inputs):
+    """ Resize first tensor to spatial size of second one. """
+    from keras.backend import tf as ktf
+    x, reference = inputs
+    return ktf.image.resize_images(x, ktf.shape(reference)[1:3], align_corners=True)
+
+def interp_like_shape(input_shapes):
+    x_shape, reference_shape = input_shapes
+    return tuple(reference_shape[:3]) + tuple(x_shape[3:])
+
+def VGGUnet(c, verbose=False, fully_conv=False):
+    """ Build U-Net on top of frozen imagenet VGG19.
+
+    Args:
+        c: config
+        verbose: bool, whether to print feature levels and model summary
+        fully_conv: bool, accept images of any size (multiple of 32)
+            instead of c.img_height x c.img_width
+    """
+    if fully_conv:
+        img_input = Input(shape=(None, None, 3))
+    else:
+        img_input = Input(shape=(c.img_height, c.img_width, 3))
+
+    def resize_to_input(x):
+        if fully_conv:
+            return Lambda(InterpLike, output_shape=interp_like_shape)([x, img_input])
+        return Lambda(Interp, arguments={'shape': (c.img_height, c.img_width)})(x)
+
     vgg_level = 3
 
     # Block 1
@@ -46,15 +127,15 @@ def VGGUnet(c):
     x = MaxPooling2D((2, 2), strides=(2, 2), name='block5_pool')(x)
     f5 = x#15x20
     vgg = Model(img_input, x)
-    weights_path = get_file('vgg19_weights_tf_dim_ordering_tf_kernels_notop.h5',
-                            WEIGHTS_PATH_NO_TOP,
-                            cache_subdir='models')
+    weights_path = get_weights('vgg19_notop', c.path_to_weights_cache,
+                               c.offline)
     vgg.load_weights(weights_path, by_name=True)
     for layer in vgg.layers:
         layer.trainable = False
 
     levels = [f1, f2, f3, f4, f5]
-    print(levels)
+    if verbose:
+        print(levels)
 
     d = levels[vgg_level]
 
@@ -87,14 +168,63 @@ def VGGUnet(c):
     # d = Activation('relu')(d)
 
     normal_output = Conv2D(c.n_classes, (1, 1))(d)
-    normal_output = Lambda(Interp, arguments={'shape': (c.img_height, c.img_width)})(normal_output)
+    normal_output = resize_to_input(normal_output)
     normal_output = Activation('sigmoid', name='normal_output')(normal_output)
 
     multiobject_output = Conv2D(c.n_classes, (1, 1))(d)
-    multiobject_output = Lambda(Interp, arguments={'shape': (c.img_height, c.img_width)})(multiobject_output)
+    multiobject_output = resize_to_input(multiobject_output)
     multiobject_output = Activation('sigmoid', name='multiobject_output')(multiobject_output)
 
     finalmodel = Model(inputs=img_input, outputs=[normal_output, multiobject_output])
-    finalmodel.summary()
+    if verbose:
+        finalmodel.summary()
 
     return finalmodel
+
+def _builder_hash(c, fully_conv):
+    """ Return short hash of VGGUnet code and config fields it depends on. """
+    params = {'n_classes': c.n_classes, 'fully_conv': fully_conv,
+              'img_size': None if fully_conv else [c.img_height, c.img_width]}
+    md5 = hashlib.md5(inspect.getsource(VGGUnet).encode('utf-8'))
+    md5.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return md5.hexdigest()[:8]
+
+def get_unet(c, path_to_cache=None, fully_conv=False):
+    """ Build VGGUnet or restore it from serialized architecture and weights.
+
+    The first build stores architecture as json and initial weights as h5,
+    next calls only deserialize them, without touching VGG19 weights.
+    Cache name has a hash of VGGUnet code and config, so changed network
+    is built again.
+
+    Args:
+        c: config
+        path_to_cache: str, directory for serialized model,
+            defaults to c.path_to_models
+        fully_conv: bool, build model for images of any size
+
+    Returns:
+        keras Model, not compiled
+    """
+    path_to_cache = path_to_cache or c.path_to_models
+    if fully_conv:
+        name = 'vgg_unet_fcn_{}'.format(c.n_classes)
+    else:
+        name = 'vgg_unet_{}x{}_{}'.format(c.img_height, c.img_width, c.n_classes)
+    name += '_' + _builder_hash(c, fully_conv)
+    path_to_json = os.path.join(path_to_cache, name + '.json')
+    path_to_weights = os.path.join(path_to_cache, name + '.h5')
+    if os.path.isfile(path_to_json) and os.path.isfile(path_to_weights):
+        with open(path_to_json, 'r') as f:
+            model = model_from_json(f.read(), custom_objects={
+                'Interp': Interp, 'InterpLike': InterpLike,
+                'interp_like_shape': interp_like_shape})
+        model.load_weights(path_to_weights)
+        return model
+
+    model = VGGUnet(c, fully_conv=fully_conv)
+    os.makedirs(path_to_cache, exist_ok=True)
+    with open(path_to_json, 'w') as f:
+        f.write(model.to_json())
+    model.save_weights(path_to_weights)
+    return model
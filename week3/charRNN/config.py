@@ -2,9 +2,11 @@ from tools import Config
 
 config = Config(
     path_to_texts='./OE',
+    path_to_corpus='./corpus', # cleaned and encoded texts, built on first run
     test_size = 0.1,
     batch_size = 1024,
     max_len = 100,
+    embedding_size = 0, # > 0 to feed char indexes into Embedding, 0 for one-hot
 
 
     #train config
@@ -13,6 +15,10 @@ config = Config(
     path_to_models = './models',
     epochs = 200,
     max_queue_size = 100,
-    workers = 1
+    workers = 1,
+    use_multiprocessing = False,
+    steps_per_epoch = 200,
+    validation_steps = 50, # batches of held out documents per validation
+    seed = 0 # choice of files and fragments
     )
 
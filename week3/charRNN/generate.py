@@ -0,0 +1,46 @@
+import os
+import argparse
+
+import numpy as np
+from keras.models import load_model
+
+import tools
+
+
+def main(args):
+    model = load_model(args.path_to_model)
+    codec = tools.TextCodec(tools.CHARS)
+    # grid of temperatures is repeated over all samples
+    temperatures = np.resize(np.array(args.temperatures, dtype=np.float64),
+                             args.n_samples)
+    generator = tools.TextGenerator(model, codec, args.n_samples)
+    texts = generator.generate(args.init_sentence, args.size, temperatures,
+                               args.stop_char, np.random.RandomState(args.seed))
+    print('{} texts, {:.0f} chars/s'.format(len(texts), generator.chars_per_sec))
+
+    os.makedirs(args.path_to_results, exist_ok=True)
+    with open(os.path.join(args.path_to_results, 'generated.txt'), 'w') as f:
+        for t, text in zip(temperatures, texts):
+            f.write('### temperature {:.2f}\n{}{}\n'.format(t, args.init_sentence, text))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-path_to_model', type=str, default='./models/model_OE',
+                        help="path to saved model")
+    parser.add_argument('-path_to_results', type=str, default='./results',
+                        help="path where generated.txt will be saved")
+    parser.add_argument('-init_sentence', type=str, default='\n',
+                        help="text to continue")
+    parser.add_argument('-size', type=int, default=500,
+                        help="max number of generated chars")
+    parser.add_argument('-n_samples', type=int, default=256,
+                        help="number of texts generated together")
+    parser.add_argument('-temperatures', type=float, nargs='+',
+                        default=[0.2, 0.5, 1.0, 1.2],
+                        help="temperatures, repeated over samples")
+    parser.add_argument('-stop_char', type=str, default=None,
+                        help="text ends at this char")
+    parser.add_argument('-seed', type=int, default=0)
+    args = parser.parse_args()
+    main(args)
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import json
 import fnmatch
 import math
 import random
 from operator import itemgetter
-from collections import defaultdict
-import re
+from collections import defaultdict, Counter
+import time
 
 import numpy as np
+from keras.models import Sequential
+
+# modules shared by all weeks live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from indexed_sequence import (IndexedSequence, SequenceCheckpoint,
+                              load_sequence_state, queue_size)
+
 
 # CHARS = '\n !&(),-./0123456789:;?ABHIKMOVX_`aceijmopqrtxy| «»ЄІЇАБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЬЮЯабвгдежзийклмнопрстуфхцчшщыьэюяєіїҐґ—’…'
 CHARS = '\n !&(),-./0123456789:;?ABHIKMOVX_`aceijmopqrtxy|«»ЄІЇАБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЬЮЯабвгдежзийклмнопрстуфхцчшщыьэюяєіїҐґ—’…'
@@ -99,27 +108,169 @@ def get_file_name(filepath: str) -> str:
     return filename
 
 
+class TextCodec:
+    """ Map texts to char indexes and back in bulk.
+
+    Code points of a text are looked up in one precomputed numpy table,
+    chars out of vocabulary are dropped (and optionally counted), so no
+    regex is built or run. One codec is shared by training and generation.
+
+    Args:
+        chars: str, vocabulary, index of char is its position
+    """
+
+    def __init__(self, chars=CHARS):
+        self.chars = chars
+        self.char_to_ind = {ch:i for i, ch in enumerate(chars)}
+        codes = np.array([ord(ch) for ch in chars])
+        self._lookup = np.full(codes.max() + 1, -1, dtype=np.int16)
+        self._lookup[codes] = np.arange(len(chars))
+        self._chars = np.array(list(chars))
+
+    def __len__(self):
+        return len(self.chars)
+
+    def encode(self, text, oov_counter=None):
+        """ Return np.array of uint8 indexes of chars of `text` in vocabulary.
+
+        Args:
+            text: str
+            oov_counter: Counter, optional, updated with dropped chars
+        """
+        points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        ids = np.where(points < len(self._lookup),
+                       self._lookup[np.minimum(points, len(self._lookup) - 1)], -1)
+        known = ids >= 0
+        if oov_counter is not None and not known.all():
+            oov, counts = np.unique(points[~known], return_counts=True)
+            oov_counter.update(dict(zip(map(chr, oov.tolist()), counts.tolist())))
+        return ids[known].astype(np.uint8)
+
+    def decode(self, ids):
+        """ Return str of char indexes. """
+        return ''.join(self._chars[np.asarray(ids, dtype=np.int64)].tolist())
+
+    def clean(self, text):
+        """ Return `text` without chars out of vocabulary. """
+        return self.decode(self.encode(text))
+
+    def oov_stats(self, texts):
+        """ Return number of chars, number of dropped chars and Counter of
+        dropped chars over all `texts`. """
+        counter = Counter()
+        n_chars = 0
+        for text in texts:
+            n_chars += len(text)
+            self.encode(text, counter)
+        return n_chars, sum(counter.values()), counter
+
+
 def get_dict():
-    char_to_ind = {ch:i for i, ch in enumerate(CHARS)}
-    return char_to_ind
-
-def get_generator(paths, char_to_ind, max_len, batch_size):
-    # char_to_ind - dict
-    while True:
-        file_ = random.sample(paths, 1)[0]
-        with open(file_, 'r') as f:
-            text = f.read()
-        # remove all char not in dict
-        text = re.sub('[^'+CHARS+']', '', text)
-
-        data = np.zeros(shape=[batch_size, max_len+1, len(char_to_ind)],
-                    dtype=np.int8)
-        for b in range(batch_size):
-            s = random.randint(0, len(text)-max_len-1)
-            for i, ch in enumerate(text[s:s+max_len+1]):
-                data[b, i, char_to_ind[ch]] = 1
-        yield data[:, :-1, :], data[:, 1:, :]
-    
+    return TextCodec().char_to_ind
+
+def build_corpus(paths, codec, path_to_corpus):
+    """ Clean and encode all texts once.
+
+    Writes to `path_to_corpus` directory
+        ids.npy: uint8, char indexes of all texts concatenated
+        offsets.npy: int64 [n_texts + 1], text i is ids[offsets[i]:offsets[i+1]]
+        meta.json: paths and chars the corpus was built with, and number
+            of chars out of vocabulary
+    """
+    os.makedirs(path_to_corpus, exist_ok=True)
+    oov = Counter()
+    docs = []
+    for path in paths:
+        with open(path, 'r') as f:
+            docs.append(codec.encode(f.read(), oov))
+    offsets = np.cumsum([0] + [len(d) for d in docs], dtype=np.int64)
+    ids = np.lib.format.open_memmap(os.path.join(path_to_corpus, 'ids.npy'),
+                                    mode='w+', dtype=np.uint8,
+                                    shape=(int(offsets[-1]),))
+    for doc, start in zip(docs, offsets):
+        ids[start:start + len(doc)] = doc
+    ids.flush()
+    del ids
+    np.save(os.path.join(path_to_corpus, 'offsets.npy'), offsets)
+    n_oov = sum(oov.values())
+    print('corpus: {} chars, {} ({:.3%}) out of vocabulary, most common: {}'.format(
+        offsets[-1] + n_oov, n_oov, n_oov / max(offsets[-1] + n_oov, 1),
+        oov.most_common(10)))
+    # meta is written last, so interrupted build is redone
+    with open(os.path.join(path_to_corpus, 'meta.json'), 'w') as f:
+        json.dump({'paths': paths, 'chars': codec.chars, 'oov': dict(oov)}, f)
+
+def prepare_corpus(paths, codec, path_to_corpus):
+    """ Build corpus of `paths` unless it is already built. """
+    path = os.path.join(path_to_corpus, 'meta.json')
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            meta = json.load(f)
+        if meta['paths'] == paths and meta['chars'] == codec.chars:
+            return
+    build_corpus(paths, codec, path_to_corpus)
+
+
+class TextSequence(IndexedSequence):
+    """ Batches of encoded random text fragments.
+
+    Fragments are cut from documents of corpus built by `build_corpus`,
+    every fragment from a randomly chosen document at a random position,
+    all of them by one fancy index of memory mapped char indexes.
+    Targets are inputs shifted by one char.
+
+    Args:
+        path_to_corpus: str, directory written by `build_corpus`
+        codec: TextCodec the corpus was built with
+        max_len: int, length of fragment
+        batch_size: int
+        steps: int, number of batches in one epoch
+        seed: int, random seed
+        sparse: bool, yield char indexes [batch, max_len] and targets
+            [batch, max_len, 1] for Embedding input and sparse categorical
+            crossentropy, instead of one-hot arrays
+        docs: list of int, documents to sample from, defaults to all
+    """
+
+    def __init__(self, path_to_corpus, codec, max_len, batch_size, steps,
+                 seed=0, sparse=False, docs=None):
+        super().__init__(steps*batch_size, batch_size, seed, shuffle=False)
+        self.path_to_corpus = path_to_corpus
+        self.dict_size = len(codec)
+        self.max_len = max_len
+        self.sparse = sparse
+        self.offsets = np.load(os.path.join(path_to_corpus, 'offsets.npy'))
+        self.lengths = np.diff(self.offsets)
+        docs = np.arange(len(self.lengths)) if docs is None else np.asarray(docs)
+        # only documents longer than a fragment
+        self.docs = docs[self.lengths[docs] > max_len]
+        self._ids = None
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = np.load(os.path.join(self.path_to_corpus, 'ids.npy'),
+                                mmap_mode='r')
+        return self._ids
+
+    def get_batch(self, indexes, rng):
+        docs = self.docs[rng.randint(len(self.docs), size=len(indexes))]
+        starts = self.offsets[docs] + (rng.rand(len(indexes)) *
+                                       (self.lengths[docs] - self.max_len)).astype(np.int64)
+        codes = self.ids[starts[:, None] + np.arange(self.max_len+1)]
+        if self.sparse:
+            return codes[:, :-1].astype(np.int32), codes[:, 1:, None]
+        data = np.zeros(shape=[len(indexes), self.max_len+1, self.dict_size],
+                        dtype=np.int8)
+        data[np.arange(len(indexes))[:, None], np.arange(self.max_len+1), codes] = 1
+        return data[:, :-1, :], data[:, 1:, :]
+
+    def __getstate__(self):
+        # memory map would be pickled as full array
+        state = self.__dict__.copy()
+        state['_ids'] = None
+        return state
+
 def sample(preds, temperature=1.0):
     # helper function to sample an index from a probability array
     preds = np.asarray(preds).astype('float64')
@@ -130,17 +281,116 @@ def sample(preds, temperature=1.0):
     return np.argmax(probas)
 
 
+def sample_batch(preds, temperature=1.0, rng=None):
+    """ Sample one index from every row of probabilities by Gumbel-max trick.
+
+    Args:
+        preds: np.array [batch, dict_size], probabilities
+        temperature: float or array [batch], temperature of every row
+        rng: RandomState, defaults to numpy global one
+
+    Returns:
+        np.array [batch], sampled indexes
+    """
+    rng = rng or np.random
+    logits = np.log(np.maximum(preds, 1e-12)) / np.reshape(temperature, (-1, 1))
+    return np.argmax(logits - np.log(-np.log(rng.uniform(1e-12, 1., preds.shape))),
+                     axis=1)
+
+RECURRENT_LAYERS = {'LSTM', 'GRU', 'SimpleRNN'}
+
+def make_stateful(model, batch_size=1):
+    """ Return copy of Sequential char model that keeps recurrent state
+    between calls and accepts sequences of any length.
+
+    Args:
+        model: trained keras Sequential model, one-hot or Embedding input
+        batch_size: int, number of texts generated in parallel
+    """
+    config = model.get_config()
+    first = config[0]['config']
+    first['batch_input_shape'] = ((batch_size, None) +
+                                  tuple(first['batch_input_shape'][2:]))
+    if 'input_length' in first:
+        # Embedding
+        first['input_length'] = None
+    for layer in config:
+        if layer['class_name'] in RECURRENT_LAYERS:
+            layer['config']['stateful'] = True
+    stateful = Sequential.from_config(config)
+    stateful.set_weights(model.get_weights())
+    return stateful
+
+
+class TextGenerator:
+    """ Generate texts char by char with stateful copy of the model.
+
+    Recurrent state is carried between calls, so init sentence is read
+    once and every next char costs a single step of the model.
+
+    Args:
+        model: trained keras Sequential model
+        codec: TextCodec the model was trained with
+        batch_size: int, number of texts generated in parallel
+
+    Attributes:
+        chars_per_sec: float, speed of the last `generate` call
+    """
+
+    def __init__(self, model, codec, batch_size=1):
+        self.model = make_stateful(model, batch_size)
+        self.codec = codec
+        self.batch_size = batch_size
+        self.chars_per_sec = 0.
+
+    def predict(self, codes):
+        """ Feed chars and return next char probabilities.
+
+        Args:
+            codes: np.array [batch_size, steps], char indexes
+
+        Returns:
+            np.array [batch_size, dict_size]
+        """
+        if len(self.model.input_shape) == 2:
+            # Embedding input
+            return self.model.predict_on_batch(codes)[:, -1]
+        x = np.zeros(codes.shape + (len(self.codec),), dtype=np.float32)
+        x[np.arange(len(codes))[:, None], np.arange(codes.shape[1]), codes] = 1
+        return self.model.predict_on_batch(x)[:, -1]
+
+    def generate(self, init_sentence, size, diversity=1.0, stop_char=None,
+                 rng=None):
+        """ Generate `batch_size` continuations of `init_sentence`.
+
+        Args:
+            init_sentence: str
+            size: int, max number of generated chars
+            diversity: float or array [batch_size], temperature of every text
+            stop_char: str, text ends at this char (excluded), generation
+                stops when all texts ended
+            rng: RandomState, defaults to numpy global one
+
+        Returns:
+            list of `batch_size` str
+        """
+        codes = self.codec.encode(init_sentence)
+        stop = self.codec.char_to_ind.get(stop_char, -1)
+        start = time.time()
+        self.model.reset_states()
+        preds = self.predict(np.tile(codes, (self.batch_size, 1)))
+        generated = np.empty((self.batch_size, size), dtype=np.int64)
+        lengths = np.full(self.batch_size, size)
+        for i in range(size):
+            generated[:, i] = sample_batch(preds, diversity, rng)
+            lengths[(generated[:, i] == stop) & (lengths == size)] = i
+            if (lengths < size).all():
+                break
+            preds = self.predict(generated[:, i:i+1])
+        self.chars_per_sec = lengths.sum() / max(time.time() - start, 1e-6)
+        return [self.codec.decode(text[:l]) for text, l in zip(generated, lengths)]
+
+
 def generate_text(model, init_sentence, diversity, size, char_to_ind):
-    ind_to_char = {v:k for k, v in char_to_ind.items()}
-    init_sentence = re.sub('[^'+CHARS+']', '', init_sentence)
-    generated = ''
-    for i in range(size):
-        x = np.zeros((1, len(init_sentence), len(char_to_ind)))
-        for t, char in enumerate(init_sentence):
-            x[0, t, char_to_ind[char]] = 1.
-        preds = model.predict(x, verbose=0)[0][-1, :]
-        next_index = sample(preds, diversity)
-        next_char = ind_to_char[next_index]
-        generated += next_char
-        init_sentence = init_sentence[1:] + next_char
-    return generated
\ No newline at end of file
+    codec = TextCodec(''.join(sorted(char_to_ind, key=char_to_ind.get)))
+    return TextGenerator(model, codec).generate(init_sentence, size, diversity)[0]
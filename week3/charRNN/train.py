@@ -1,6 +1,6 @@
 from keras.models import Sequential
 from keras.layers import Dense, Activation, TimeDistributed
-from keras.layers import LSTM
+from keras.layers import LSTM, Embedding
 from keras.optimizers import SGD
 from keras.callbacks import EarlyStopping, ProgbarLogger, ModelCheckpoint
 from keras.callbacks import LearningRateScheduler, CSVLogger, TensorBoard
@@ -16,17 +16,27 @@ from config import config as c
 
 
 paths = tools.find_files(c.path_to_texts, '*.txt')
-random.shuffle(paths)
-# edge = int(len(paths)*c.test_size)
-# train_paths = paths[:-edge]
-# test_paths = paths[-edge:]
 
-char_to_ind = tools.get_dict()
-dict_size = len(char_to_ind)
+codec = tools.TextCodec(tools.CHARS)
+dict_size = len(codec)
 
-train_gen = tools.get_generator(paths, char_to_ind, c.max_len, c.batch_size)
-# train_gen = tools.get_generator(train_paths, char_to_ind, c.max_len, c.batch_size)
-# test_gen = tools.get_generator(test_paths, char_to_ind, c.max_len, c.batch_size)
+# texts are cleaned and encoded once
+tools.prepare_corpus(paths, codec, c.path_to_corpus)
+# whole documents are held out for validation
+docs = list(range(len(paths)))
+random.Random(c.seed).shuffle(docs)
+edge = int(len(docs)*c.test_size)
+train_docs = docs[edge:]
+test_docs = docs[:edge]
+
+train_gen = tools.TextSequence(c.path_to_corpus, codec, c.max_len,
+                               c.batch_size, c.steps_per_epoch, c.seed,
+                               sparse=bool(c.embedding_size), docs=train_docs)
+test_gen = None
+if test_docs:
+    test_gen = tools.TextSequence(c.path_to_corpus, codec, c.max_len,
+                                  c.batch_size, c.validation_steps, c.seed,
+                                  sparse=bool(c.embedding_size), docs=test_docs)
 
 def get_model():
     if os.path.isfile(c.path_to_models+'/model_all'):
@@ -34,13 +44,19 @@ def get_model():
         print('model loaded')
     else:
         model = Sequential()
-        model.add(LSTM(256, return_sequences=True, input_shape=(c.max_len, dict_size)))
+        if c.embedding_size:
+            model.add(Embedding(dict_size, c.embedding_size, input_length=c.max_len))
+            model.add(LSTM(256, return_sequences=True))
+        else:
+            model.add(LSTM(256, return_sequences=True, input_shape=(c.max_len, dict_size)))
         model.add(LSTM(256, return_sequences=True, input_shape=(c.max_len, 256)))
         model.add(LSTM(256, return_sequences=True, input_shape=(c.max_len, 256)))
         model.add(TimeDistributed(Dense(dict_size)))
         model.add(Activation('softmax'))
-    model.compile(optimizer=SGD(lr=1e-3, momentum=0.9),
-                  loss='categorical_crossentropy')
+    # char indexes as targets save one-hot arrays
+    loss = ('sparse_categorical_crossentropy' if c.embedding_size
+            else 'categorical_crossentropy')
+    model.compile(optimizer=SGD(lr=1e-3, momentum=0.9), loss=loss)
     return model
 
 model = get_model()
@@ -54,18 +70,20 @@ call_backs =[
     ModelCheckpoint(c.path_to_models+'/model_OE', save_best_only=True),
     # LearningRateScheduler(lambda x: tools.lr_scheduler(x, c)),
     # CSVLogger(c.path_to_log),
-    TensorBoard(c.path_to_summaries)
+    TensorBoard(c.path_to_summaries),
+    tools.SequenceCheckpoint(train_gen)
     ]
 
 model.fit_generator(generator=train_gen,
-                    steps_per_epoch=200,
+                    steps_per_epoch=len(train_gen),
                     epochs=c.epochs,
                     verbose=1,
                     callbacks=call_backs,
-                    # validation_data=test_gen,
-                    # validation_steps=50,
-                    max_queue_size=c.max_queue_size,
-                    workers=c.workers)
+                    validation_data=test_gen,
+                    validation_steps=c.validation_steps,
+                    max_queue_size=tools.queue_size(train_gen, c.max_queue_size),
+                    workers=c.workers,
+                    use_multiprocessing=c.use_multiprocessing)
 model.save(c.path_to_models+'/model_OE')
 
 
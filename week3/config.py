@@ -3,6 +3,7 @@ from tools import Config
 config = Config(
     # data config
     path_to_train_data='./facs',
+    path_to_packed_data='./facs_packed', # packed on first run, delete to repack
     test_size = 0.1,
     batch_size = 2,############################################
     img_height = 48,############################################
@@ -10,14 +11,20 @@ config = Config(
     n_emotions = 7,
     n_action_units = 65, # target action units
     landmark_size = 136, # number of features that provide dlib
+    align_landmarks = True, # center, rotate to eye line and scale landmarks
     img_shape = (640, 490, 3), # original image shape
     n_frames = 10, # number of images in sequence
+    frame_sampling = 'linear', # 'nearest' or 'linear' blend of source frames
+    keyframe_power = 1., # > 1 samples more frames near the apex (last frame)
+    use_feature_cache = True, # train only head on cached frozen VGGFace features
     # train config
     path_to_summaries = './summaries',
     path_to_log = './log.csv',
     path_to_models = './models',
     epochs = 100,
     max_queue_size = 100,
-    workers = 1
+    workers = 1,
+    use_multiprocessing = False,
+    seed = 0 # data order
     )
 
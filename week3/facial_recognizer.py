@@ -5,44 +5,68 @@ from keras.layers import Concatenate
 from keras.models import Sequential
 
 from config import config as c
-def facial_recognizer(c):
-    # inputs
-    img_inputs = Input(shape=(c.n_frames, c.img_height, c.img_width, 3),
-                    name="img_inputs")
-    landmark_inputs = Input(shape=(c.n_frames, c.landmark_size), name="landmark_inputs")
 
-    # image feature extractor
-    def get_feature_extractor():
-        vgg_model = VGGFace(include_top=False,
-                            input_shape=(c.img_height, c.img_width, 3),
-                            pooling='avg')
-        for layer in vgg_model.layers:
-            layer.trainable = False
-        last_layer = vgg_model.get_layer('pool5')
-        
-        vgg_feature_extractor = Sequential()
-        vgg_feature_extractor.add(last_layer)
-        vgg_feature_extractor.add(Flatten())
-        vgg_feature_extractor.add(Dense(4096, activation='elu'))
-        vgg_feature_extractor.add(Dense(2048, activation='elu'))
-        return vgg_feature_extractor
-
-    vgg_feature_extractor = get_feature_extractor()
-    img_features = TimeDistributed(vgg_feature_extractor)(img_inputs)
-    print(img_features)
+def get_trunk(c):
+    """ Return frozen VGGFace convolutional trunk, image -> pool5 features. """
+    vgg_model = VGGFace(include_top=False,
+                        input_shape=(c.img_height, c.img_width, 3),
+                        pooling='avg')
+    for layer in vgg_model.layers:
+        layer.trainable = False
+    last_layer = vgg_model.get_layer('pool5')
+    features = Flatten()(last_layer.output)
+    return Model(inputs=vgg_model.input, outputs=features, name='vgg_trunk')
+
+def _head(c, img_features, landmark_inputs):
+    """ Apply trainable layers to per frame image features and landmarks. """
+    image_encoder = Sequential()
+    image_encoder.add(Dense(4096, activation='elu',
+                            input_shape=(int(img_features.shape[-1]),)))
+    image_encoder.add(Dense(2048, activation='elu'))
+    img_features = TimeDistributed(image_encoder, name='image_encoder')(img_features)
 
     # landmark feature extractor
     landmark_encoder = Sequential()
     landmark_encoder.add(Dense(256, activation='elu', input_shape=(c.landmark_size,)))
     landmark_encoder.add(Dense(128, activation='elu'))
-    landmark_features = TimeDistributed(landmark_encoder)(landmark_inputs)
+    landmark_features = TimeDistributed(landmark_encoder,
+                                        name='landmark_encoder')(landmark_inputs)
 
     all_features = Concatenate(axis=-1)([img_features, landmark_features])
-    lstm_out = LSTM(256)(all_features)
+    lstm_out = LSTM(256, name='lstm')(all_features)
 
     out_emotion = Dense(c.n_emotions, activation='softmax', name='out_emotion')(lstm_out)
     out_au = Dense(c.n_action_units, activation='sigmoid', name='out_au')(lstm_out)
+    return out_emotion, out_au
+
+def facial_recognizer(c):
+    # inputs
+    img_inputs = Input(shape=(c.n_frames, c.img_height, c.img_width, 3),
+                    name="img_inputs")
+    landmark_inputs = Input(shape=(c.n_frames, c.landmark_size), name="landmark_inputs")
+
+    img_features = TimeDistributed(get_trunk(c), name='vgg_trunk')(img_inputs)
+    out_emotion, out_au = _head(c, img_features, landmark_inputs)
 
     model = Model(inputs=[img_inputs, landmark_inputs], outputs=[out_emotion, out_au])
 
-    return model
\ No newline at end of file
+    return model
+
+def facial_recognizer_head(c, feature_size):
+    """ Return trainable part of facial_recognizer fed by cached trunk features.
+
+    Layers have the same names as in `facial_recognizer`, so weights of
+    trained head are loaded into full model by `load_weights(..., by_name=True)`.
+    """
+    img_features = Input(shape=(c.n_frames, feature_size), name="img_features")
+    landmark_inputs = Input(shape=(c.n_frames, c.landmark_size), name="landmark_inputs")
+
+    out_emotion, out_au = _head(c, img_features, landmark_inputs)
+
+    return Model(inputs=[img_features, landmark_inputs], outputs=[out_emotion, out_au])
+
+def load_recognizer(c, path_to_model):
+    """ Return full facial_recognizer with weights of full or head checkpoint. """
+    model = facial_recognizer(c)
+    model.load_weights(path_to_model, by_name=True)
+    return model
@@ -0,0 +1,133 @@
+import os
+import time
+import argparse
+
+import numpy as np
+from keras.preprocessing import image
+from keras_vggface.utils import preprocess_input
+
+import tools
+import landmarks as landmarks_io
+from config import config
+from facial_recognizer import get_trunk, facial_recognizer_head
+
+# CK+ emotion labels, 1..7 in dataset
+EMOTIONS = ('anger', 'contempt', 'disgust', 'fear', 'happy', 'sadness', 'surprise')
+
+
+class StreamingRecognizer:
+    """ Recognize facial expression over a stream of frames.
+
+    Trunk features and landmarks of the last `c.n_frames` frames are kept
+    in a ring buffer, so every new frame costs one trunk pass and one pass
+    of the small recurrent head. Until the buffer is full the first frame
+    is repeated, so predictions start from the first frame.
+
+    Note that the model is trained on whole onset->apex sequences
+    resampled to `c.n_frames`, while the stream gives the last frames.
+
+    Args:
+        c: config
+        path_to_model: str, full or head checkpoint of facial_recognizer
+    """
+
+    def __init__(self, c, path_to_model):
+        self.c = c
+        self.trunk = get_trunk(c)
+        self.head = facial_recognizer_head(c, int(self.trunk.output_shape[-1]))
+        self.head.load_weights(path_to_model, by_name=True)
+        self.features = np.zeros((c.n_frames, int(self.trunk.output_shape[-1])),
+                                 dtype=np.float32)
+        self.landmarks = np.zeros((c.n_frames, c.landmark_size), dtype=np.float32)
+        self.n_seen = 0
+
+    def reset(self):
+        """ Start a new stream. """
+        self.n_seen = 0
+
+    def _buffered(self, buffer):
+        """ Return buffer in time order, padded by the first frame. """
+        n = self.c.n_frames
+        if self.n_seen < n:
+            return buffer[np.maximum(np.arange(n) - (n - self.n_seen), 0)]
+        return buffer[(self.n_seen + np.arange(n)) % n]
+
+    def push(self, img, landmarks=None):
+        """ Add frame and return emotion and action unit probabilities.
+
+        Args:
+            img: np.array [img_height, img_width, 3], values in 0..255
+            landmarks: np.array [landmark_size], aligned as in training,
+                None if unknown
+
+        Returns:
+            emotion: np.array [n_emotions]
+            action_units: np.array [n_action_units]
+        """
+        pos = self.n_seen % self.c.n_frames
+        x = preprocess_input(img[None].astype(np.float32))
+        self.features[pos] = self.trunk.predict_on_batch(x)[0]
+        self.landmarks[pos] = 0 if landmarks is None else landmarks
+        self.n_seen += 1
+        emotion, action_units = self.head.predict_on_batch(
+            [self._buffered(self.features)[None],
+             self._buffered(self.landmarks)[None]])
+        return emotion[0], action_units[0]
+
+
+def iter_frames(c, path_to_frames, pattern, path_to_landmarks=None):
+    """ Yield path, image and landmarks of sorted frame files.
+
+    Frame files stand in for a camera. Landmark files (dlib 68 points,
+    as in CK+) are matched to frames by sorted order.
+    """
+    paths = tools.find_files(path_to_frames, pattern)
+    landmark_paths = [None]*len(paths)
+    if path_to_landmarks:
+        landmark_paths = tools.find_files(path_to_landmarks, '*.txt')
+    for path, landmark_path in zip(paths, landmark_paths):
+        img = image.img_to_array(image.load_img(path,
+            target_size=(c.img_height, c.img_width)))
+        points = None
+        if landmark_path is not None:
+            points = landmarks_io.load_sequence([landmark_path],
+                                                c.align_landmarks)[0]
+        yield path, img, points
+
+def main(args):
+    os.makedirs(args.path_to_results, exist_ok=True)
+    recognizer = StreamingRecognizer(config, args.path_to_model)
+    path_to_csv = os.path.join(args.path_to_results, 'predictions.csv')
+    with open(path_to_csv, 'w') as f:
+        f.write('frame,emotion,' + ','.join(EMOTIONS) + ',top_action_units\n')
+        start, n = time.time(), 0
+        for path, img, points in iter_frames(config, args.path_to_frames,
+                                             args.pattern, args.path_to_landmarks):
+            emotion, action_units = recognizer.push(img, points)
+            top_au = np.argsort(action_units)[::-1][:args.top_au]
+            label = EMOTIONS[int(np.argmax(emotion))]
+            f.write('{},{},{},{}\n'.format(
+                os.path.basename(path), label,
+                ','.join('{:.4f}'.format(p) for p in emotion),
+                ' '.join(str(au) for au in top_au)))
+            print('{} {} {:.2f}'.format(os.path.basename(path), label, emotion.max()))
+            n += 1
+    print('{} frames, {:.1f} frames/s'.format(n, n / max(time.time() - start, 1e-6)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-path_to_frames', type=str,
+                        help="dir with frames of one stream")
+    parser.add_argument('-path_to_landmarks', type=str, default=None,
+                        help="dir with landmark .txt files of frames")
+    parser.add_argument('-path_to_model', type=str, default='./models/model_OE_head',
+                        help="path to full or head checkpoint")
+    parser.add_argument('-path_to_results', type=str, default='./results',
+                        help="path where predictions.csv will be saved")
+    parser.add_argument('-pattern', type=str, default='*.png',
+                        help="pattern of frame files in dir")
+    parser.add_argument('-top_au', type=int, default=3,
+                        help="number of most probable action units to save")
+    args = parser.parse_args()
+    main(args)
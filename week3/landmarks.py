@@ -0,0 +1,57 @@
+""" Parsing and normalization of dlib 68 point facial landmarks.
+
+Landmarks of CK+ are stored one file per frame, every line is "x y" of
+one point. All files of a sequence are parsed by one `np.loadtxt` call
+and normalized for all frames at once.
+"""
+import numpy as np
+
+N_POINTS = 68
+# dlib indexes of points around the eyes
+RIGHT_EYE = slice(36, 42)
+LEFT_EYE = slice(42, 48)
+
+
+def _lines(paths):
+    for path in paths:
+        with open(path, 'r') as f:
+            yield from f
+
+def read_landmarks(paths):
+    """ Return landmarks of frames as np.array [frames, 68, 2]. """
+    points = np.loadtxt(_lines(paths), dtype=np.float32, ndmin=2)
+    return points.reshape(len(paths), N_POINTS, 2)
+
+def normalize(points):
+    """ Align landmarks of every frame.
+
+    Points are centered at their mean, rotated so that the line between
+    eye centers is horizontal and scaled to unit distance between eyes,
+    so only facial expression is left.
+
+    Args:
+        points: np.array [frames, 68, 2]
+
+    Returns:
+        np.array [frames, 68, 2], float32
+    """
+    points = points - points.mean(axis=1, keepdims=True)
+    eyes = points[:, LEFT_EYE].mean(axis=1) - points[:, RIGHT_EYE].mean(axis=1)
+    dist = np.maximum(np.hypot(eyes[:, 0], eyes[:, 1]), 1e-6)
+    cos, sin = eyes[:, 0]/dist, eyes[:, 1]/dist
+    # rotation by minus eye line angle, divided by eye distance
+    rotation = np.stack([np.stack([cos, sin], axis=-1),
+                         np.stack([-sin, cos], axis=-1)], axis=-1)/dist[:, None, None]
+    return np.einsum('fpi,fij->fpj', points, rotation).astype(np.float32)
+
+def load_sequence(paths, align=True):
+    """ Return landmark features of frames as np.array [frames, 136].
+
+    Args:
+        paths: list of str, landmark files of frames in order
+        align: bool, whether to normalize landmarks
+    """
+    points = read_landmarks(paths)
+    if align:
+        points = normalize(points)
+    return points.reshape(len(paths), -1)
@@ -0,0 +1,116 @@
+""" Temporal resampling of frame sequences to a fixed number of frames.
+
+Frames are picked or blended at fractional source positions, no spline
+prefiltering of the whole volume is done. All functions work on a batch
+of sequences padded to the same length.
+
+Usage (benchmark against scipy zoom):
+    python temporal.py -batch_size 32 -n_frames 10
+"""
+import time
+import argparse
+
+import numpy as np
+from scipy import ndimage as nd
+
+
+def frame_positions(lengths, n_frames, keyframe_power=1.):
+    """ Return fractional source positions of output frames.
+
+    Args:
+        lengths: array-like [batch], number of frames of every sequence
+        n_frames: int, number of output frames
+        keyframe_power: float, 1 samples uniformly, > 1 samples densely
+            towards the last frame (apex of CK+ like onset->apex
+            sequences). First and last frames are always kept.
+
+    Returns:
+        np.array [batch, n_frames]
+    """
+    t = np.linspace(0, 1, n_frames)
+    if keyframe_power != 1:
+        t = 1 - (1 - t)**keyframe_power
+    return t[None, :]*(np.asarray(lengths)[:, None] - 1)
+
+def _weights_shape(positions, frames):
+    return positions.shape + (1,)*(frames.ndim - 2)
+
+def select(frames, positions):
+    """ Return nearest source frames.
+
+    Args:
+        frames: np.array [batch, max_len, ...]
+        positions: np.array [batch, n_frames], fractional positions
+
+    Returns:
+        np.array [batch, n_frames, ...] of frames dtype
+    """
+    b = np.arange(len(frames))[:, None]
+    return frames[b, np.rint(positions).astype(np.int64)]
+
+def blend(frames, positions):
+    """ Return linear blend of two nearest source frames, float32. """
+    b = np.arange(len(frames))[:, None]
+    lo = np.floor(positions).astype(np.int64)
+    hi = np.minimum(lo + 1, frames.shape[1] - 1)
+    w = (positions - lo).reshape(_weights_shape(positions, frames)).astype(np.float32)
+    return frames[b, lo]*(1 - w) + frames[b, hi]*w
+
+def resample(frames, n_frames, lengths=None, method='linear', keyframe_power=1.):
+    """ Resample batch of sequences to `n_frames` frames.
+
+    Args:
+        frames: np.array [batch, max_len, ...], sequences padded at the end
+        n_frames: int, number of output frames
+        lengths: array-like [batch], real lengths, defaults to max_len
+        method: 'nearest' to select frames, 'linear' to blend them
+        keyframe_power: float, see `frame_positions`
+
+    Returns:
+        np.array [batch, n_frames, ...]
+    """
+    if lengths is None:
+        lengths = np.full(len(frames), frames.shape[1])
+    positions = frame_positions(lengths, n_frames, keyframe_power)
+    if method == 'nearest':
+        return select(frames, positions)
+    elif method == 'linear':
+        return blend(frames, positions)
+    else:
+        raise ValueError('Unknown resampling method: {}'.format(method))
+
+def _zoom(frames, lengths, n_frames):
+    """ Previous implementation: cubic spline zoom of every sequence. """
+    return np.stack([nd.interpolation.zoom(
+        f[:l].astype(np.float32), [n_frames/l] + [1]*(f.ndim - 1))
+        for f, l in zip(frames, lengths)])
+
+def benchmark(batch_size=32, n_frames=10, min_len=10, max_len=40,
+              size=(48, 48, 3), n_runs=5, seed=0):
+    """ Print time per batch of zoom and of all resampling methods. """
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(min_len, max_len + 1, batch_size)
+    frames = rng.randint(0, 256, (batch_size, max_len) + tuple(size)).astype(np.uint8)
+    methods = [('zoom', lambda: _zoom(frames, lengths, n_frames)),
+               ('nearest', lambda: resample(frames, n_frames, lengths, 'nearest')),
+               ('linear', lambda: resample(frames, n_frames, lengths, 'linear')),
+               ('keyframe', lambda: resample(frames, n_frames, lengths, 'linear', 2.))]
+    for name, run in methods:
+        run()
+        start = time.time()
+        for _ in range(n_runs):
+            run()
+        print('{:10} {:10.2f} ms/batch'.format(name, (time.time() - start)/n_runs*1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-batch_size', type=int, default=32)
+    parser.add_argument('-n_frames', type=int, default=10,
+                        help="number of output frames")
+    parser.add_argument('-max_len', type=int, default=40,
+                        help="max number of source frames")
+    parser.add_argument('-n_runs', type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.batch_size, args.n_frames, max_len=args.max_len,
+              n_runs=args.n_runs)
@@ -1,5 +1,8 @@
 import os
+import sys
+import json
 import fnmatch
+import hashlib
 import math
 import random
 from operator import itemgetter
@@ -18,6 +21,13 @@ from scipy.misc import imsave
 from scipy.signal import resample
 from scipy import ndimage as nd
 
+import temporal
+import landmarks as landmarks_io
+
+# modules shared by all weeks live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indexed_sequence import (IndexedSequence, SequenceCheckpoint,
+                              load_sequence_state, queue_size)
 
 
 def _get_fields(attr):
@@ -130,62 +140,258 @@ def fake_generator(c):
         yield ({'img_inputs': img_inputs, 'landmark_inputs': landmark_inputs},
             {'out_emotion': out_emotion, 'out_au': out_au})
 
-def resample_imgs(imgs, target_frames):
-    # imgs - 3D array frame height width
+def resample_imgs(imgs, target_frames, method='linear', keyframe_power=1.):
+    # imgs - array frame height width channels (or frame features)
     # target_frames: int, target number of frames
-    return nd.interpolation.zoom(imgs, zoom=[target_frames/len(imgs), 1, 1])
+    return temporal.resample(imgs[None], target_frames, method=method,
+                             keyframe_power=keyframe_power)[0]
+
+
+def _sequence_imgs(c, path):
+    """ Return all frames of sequence as float array [frames, h, w, 3]. """
+    return np.stack([image.img_to_array(image.load_img(img,
+                         target_size=(c.img_height, c.img_width)))
+                     for img in find_files(os.path.join(c.path_to_train_data,
+                                                        'images', path), '*.png')])
+
+def _sequence_landmarks(c, path):
+    """ Return landmarks of all frames as array [frames, landmark_size]. """
+    paths = find_files(os.path.join(c.path_to_train_data, 'landmarks', path),
+                       '*.txt')
+    if len(paths) == 0:
+        return None
+    return landmarks_io.load_sequence(paths, c.align_landmarks)
+
+def _sequence_emotion(c, path):
+    """ Return emotion label of sequence (1..n_emotions) or 0 if absent. """
+    emo_path = find_files(os.path.join(c.path_to_train_data, 'emotions', path),
+                          '*.txt')
+    if len(emo_path) == 0:
+        return 0
+    with open(emo_path[0], 'r') as f:
+        return int(float(f.read()))
+
+def _sequence_action_units(c, path):
+    """ Return multi-hot action units of sequence [n_action_units] or None.
+
+    CK+ FACS files list one "AU intensity" pair per line, AU number is
+    used as index.
+    """
+    facs_path = find_files(os.path.join(c.path_to_train_data, 'facs', path),
+                           '*.txt')
+    if len(facs_path) == 0:
+        return None
+    aus = np.loadtxt(facs_path[0], ndmin=2)[:, 0].astype(np.int64)
+    action_units = np.zeros(c.n_action_units, dtype=np.int8)
+    action_units[aus[aus < c.n_action_units]] = 1
+    return action_units
+
+def pack_sequences(c, paths, path_to_pack):
+    """ Resample every sequence once and write it into memory mapped arrays.
+
+    Writes to `path_to_pack` directory
+        images.npy: uint8 [n, n_frames, img_height, img_width, 3]
+        landmarks.npy: float32 [n, n_frames, landmark_size], aligned if
+            `c.align_landmarks`, zeros if absent
+        emotions.npy: int8 [n], emotion label, 0 if absent
+        action_units.npy: int8 [n, n_action_units], multi-hot action
+            units, -1 if absent
+        meta.json: sequence paths and config fields the arrays were built for
 
-def generator(c, paths):
-    while True:
-        random.shuffle(paths)
-        img_inputs = np.empty(c.batch_size, c.n_frames, c.img_height, c.img_width)
-        landmark_inputs = np.ones([c.batch_size, c.n_frames, c.landmark_size])
-        out_emotion = np.zeros([c.batch_size, c.n_emotions])
-        out_au = np.zeros([c.batch_size, c.n_action_units])
-        for b, path in enumerate(paths[:c.batch_size]):
-            # img_inputs
-            for img in find_files(os.path.join(c.path_to_data, 'images', path),
-                                  '*.png'):
-                imgs = []
-                img = image.img_to_array(image.load_img(img,
-                    target_size=(c.img_height, c.img_width)))
-                img = preprocess_input(img)
-                imgs.append(img)
-            imgs = np.stack(imgs)
-            imgs = resample_imgs(imgs, c.n_frames)
-            img_inputs[b] = imgs
-
-            # landmark_inputs
-            for l in find_files(os.path.join(c.path_to_data, 'landmarks', path),
-                                '*.txt'):
-                pass
-            landmark_inputs[b] = np.ones([c.n_frames, c.landmark_size])
-
-            # out_emotion
-            emo_path = find_files(os.path.join(c.path_to_data, 'emotions', path),
-                                  '*.txt')
-            if len(emo_path) == 0:
-                class_ = random.randint(1, c.n_emotions)
-            else:
-                with open(emo_path[0], 'r') as f:
-                    class_ = int(f.read())
-            
+    Args:
+        c: config
+        paths: list of str, sequence directories relative to
+            `c.path_to_train_data`/images, like 'S005/001'
+        path_to_pack: str, output directory
+    """
+    os.makedirs(path_to_pack, exist_ok=True)
+    n = len(paths)
+    open_memmap = partial(np.lib.format.open_memmap, mode='w+')
+    imgs = open_memmap(os.path.join(path_to_pack, 'images.npy'), dtype=np.uint8,
+                       shape=(n, c.n_frames, c.img_height, c.img_width, 3))
+    landmarks = open_memmap(os.path.join(path_to_pack, 'landmarks.npy'),
+                            dtype=np.float32,
+                            shape=(n, c.n_frames, c.landmark_size))
+    emotions = open_memmap(os.path.join(path_to_pack, 'emotions.npy'),
+                           dtype=np.int8, shape=(n,))
+    action_units = open_memmap(os.path.join(path_to_pack, 'action_units.npy'),
+                               dtype=np.int8, shape=(n, c.n_action_units))
+    resample = partial(resample_imgs, target_frames=c.n_frames,
+                       method=c.frame_sampling, keyframe_power=c.keyframe_power)
+    for i, path in enumerate(paths):
+        imgs[i] = np.clip(np.rint(resample(_sequence_imgs(c, path))), 0, 255)
+        points = _sequence_landmarks(c, path)
+        # landmarks are blended at the same positions as frames
+        landmarks[i] = 0 if points is None else resample(points, method='linear')
+        emotions[i] = _sequence_emotion(c, path)
+        aus = _sequence_action_units(c, path)
+        action_units[i] = -1 if aus is None else aus
+    for arr in (imgs, landmarks, emotions, action_units):
+        arr.flush()
+    del imgs, landmarks, emotions, action_units
+    # meta is written last, so interrupted packing is redone
+    with open(os.path.join(path_to_pack, 'meta.json'), 'w') as f:
+        json.dump({'paths': paths, 'params': _pack_params(c)}, f)
+
+def _pack_params(c):
+    """ Return config fields packed arrays depend on. """
+    return {'n_frames': c.n_frames,
+            'img_size': [c.img_height, c.img_width],
+            'landmark_size': c.landmark_size,
+            'n_action_units': c.n_action_units,
+            'frame_sampling': [c.frame_sampling, c.keyframe_power],
+            'align_landmarks': c.align_landmarks}
+
+def _pack_is_valid(c, path_to_pack):
+    path = os.path.join(path_to_pack, 'meta.json')
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'r') as f:
+        meta = json.load(f)
+    # added or removed sequences need repacking as well
+    return (meta.get('params') == _pack_params(c) and
+            meta.get('paths') == list_sequences(c))
+
+def list_sequences(c):
+    """ Return sorted sequence directories like 'S005/001'. """
+    path = os.path.join(c.path_to_train_data, 'images')
+    return [os.path.join(g, l) for g in sorted(os.listdir(path))
+            for l in sorted(os.listdir(os.path.join(path, g)))
+            if os.path.isdir(os.path.join(path, g, l))]
+
+def load_packed(c):
+    """ Return sequence paths and memory mapped arrays of packed dataset.
+
+    Dataset is packed on first call (or when sequences are added or
+    removed, or config changes shapes, frame sampling or landmark
+    alignment), later calls only list sequence directories of the raw
+    dataset.
+    """
+    if not _pack_is_valid(c, c.path_to_packed_data):
+        pack_sequences(c, list_sequences(c), c.path_to_packed_data)
+    with open(os.path.join(c.path_to_packed_data, 'meta.json'), 'r') as f:
+        paths = json.load(f)['paths']
+    return paths, open_packed(c.path_to_packed_data)
+
+def open_packed(path_to_pack):
+    packed = {name: np.load(os.path.join(path_to_pack, name + '.npy'), mmap_mode='r')
+              for name in ('images', 'landmarks', 'emotions', 'action_units')}
+    if os.path.isfile(os.path.join(path_to_pack, 'features.npy')):
+        packed['features'] = np.load(os.path.join(path_to_pack, 'features.npy'),
+                                     mmap_mode='r')
+    return packed
+
+def _trunk_hash(trunk):
+    """ Return md5 of trunk architecture and weights. """
+    md5 = hashlib.md5(trunk.to_json().encode('utf-8'))
+    for weights in trunk.get_weights():
+        md5.update(np.ascontiguousarray(weights).tobytes())
+    return md5.hexdigest()
+
+def cache_features(c, trunk, batch_size=256):
+    """ Compute frozen trunk features of all packed frames once.
+
+    Writes `features.npy`, float32 [n, n_frames, feature_size], next to
+    packed arrays. Cache is recomputed when the pack or the trunk changes.
 
-            
+    Args:
+        c: config
+        trunk: keras Model, frozen image -> features extractor
+        batch_size: int, number of frames in one forward pass
+    """
+    paths, packed = load_packed(c)
+    path = os.path.join(c.path_to_packed_data, 'features')
+    params = dict(_pack_params(c), trunk=_trunk_hash(trunk),
+                  feature_size=int(trunk.output_shape[-1]),
+                  sequences=hashlib.md5(json.dumps(paths).encode('utf-8')).hexdigest())
+    if os.path.isfile(path + '.json'):
+        with open(path + '.json', 'r') as f:
+            if json.load(f) == params:
+                return
+    imgs = packed['images']
+    frames = imgs.reshape((-1,) + imgs.shape[2:])
+    features = np.lib.format.open_memmap(
+        path + '.npy', mode='w+', dtype=np.float32,
+        shape=imgs.shape[:2] + (params['feature_size'],))
+    flat = features.reshape(len(frames), -1)
+    for s in range(0, len(frames), batch_size):
+        batch = preprocess_input(frames[s:s + batch_size].astype(np.float32))
+        flat[s:s + batch_size] = trunk.predict_on_batch(batch)
+    features.flush()
+    del features, flat
+    with open(path + '.json', 'w') as f:
+        json.dump(params, f)
+
+
+class FacsSequence(IndexedSequence):
+    """ Batches of face image sequences with emotion and action unit targets.
+
+    Samples are sliced from arrays written by `pack_sequences`, which are
+    memory mapped separately in every process. With `use_features` cached
+    trunk features (see `cache_features`) are yielded as `img_features`
+    instead of images, to train `facial_recognizer_head`. Targets of
+    sequences without emotion label or FACS file get zero sample weight.
 
+    Args:
+        c: config
+        indexes: list of int, packed sequences of this set
+        shuffle: bool, whether to permute sequences every epoch
+        seed: int, random seed
+        use_features: bool, whether to yield cached features
+    """
 
-        
-        yield ({'img_inputs': img_inputs, 'landmark_inputs': landmark_inputs},
-            {'out_emotion': out_emotion, 'out_au': out_au})
+    def __init__(self, c, indexes, shuffle=True, seed=0, use_features=False):
+        super().__init__(len(indexes), c.batch_size, seed, shuffle)
+        self.c = c
+        self.indexes = np.asarray(indexes)
+        self.use_features = use_features
+        self._packed = None
 
+    @property
+    def packed(self):
+        if self._packed is None:
+            self._packed = open_packed(self.c.path_to_packed_data)
+        return self._packed
+
+    def get_batch(self, indexes, rng):
+        c = self.c
+        # sorted indexes read memory map sequentially
+        inds = np.sort(self.indexes[indexes])
+        if self.use_features:
+            inputs = {'img_features': np.asarray(self.packed['features'][inds])}
+        else:
+            inputs = {'img_inputs': preprocess_input(
+                self.packed['images'][inds].astype(np.float32))}
+        inputs['landmark_inputs'] = np.asarray(self.packed['landmarks'][inds])
+        emotions = self.packed['emotions'][inds].astype(np.int64)
+        out_emotion = np.zeros([len(inds), c.n_emotions])
+        # emotions are labeled from 1, unlabeled sequences are masked out
+        labeled = emotions > 0
+        out_emotion[labeled, emotions[labeled] - 1] = 1
+        out_au = self.packed['action_units'][inds].astype(np.float32)
+        has_au = out_au[:, 0] >= 0
+        out_au[~has_au] = 0
+        weights = {'out_emotion': labeled.astype(np.float32),
+                   'out_au': has_au.astype(np.float32)}
+        return inputs, {'out_emotion': out_emotion, 'out_au': out_au}, weights
+
+    def __getstate__(self):
+        # memory maps would be pickled as full arrays
+        state = self.__dict__.copy()
+        state['_packed'] = None
+        return state
 
 
 def get_generators(c):
-    path = os.path.join(c.path_to_data, 'images')
-    paths = [os.path.join(g, l) for g in os.listdir(path) for l in os.listdir(path+g)
-        if os.path.isdir(os.path.join(path, g, l))]
-    edge = int(len(paths)*c.test_size)
-    train_paths = paths[:-edge]
-    test_paths = paths[-edge:]
-    train_gen = generator(c, train_paths)
-    test_gen = generator(c, test_paths)
+    _, packed = load_packed(c)
+    # sequences without any label give no gradient
+    labeled = ((packed['emotions'] > 0) |
+               (np.asarray(packed['action_units'][:, 0]) >= 0))
+    inds = np.flatnonzero(labeled)
+    # at least one test sequence, inds[:-0] would leave no train ones
+    edge = len(inds) - max(1, int(len(inds)*c.test_size))
+    train_gen = FacsSequence(c, inds[:edge], seed=c.seed,
+                             use_features=c.use_feature_cache)
+    test_gen = FacsSequence(c, inds[edge:], shuffle=False, seed=c.seed,
+                            use_features=c.use_feature_cache)
+    return train_gen, test_gen
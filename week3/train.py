@@ -6,36 +6,46 @@ from keras.optimizers import RMSprop
 from keras.models import load_model
 
 import tools
-from facial_recognizer import facial_recognizer
+from facial_recognizer import facial_recognizer, facial_recognizer_head, get_trunk
 from config import config as c
 
 os.makedirs(c.path_to_summaries, exist_ok=True)
 os.makedirs(c.path_to_models, exist_ok=True)
 
+if c.use_feature_cache:
+    # frozen trunk is run once per frame, only the head is trained
+    trunk = get_trunk(c)
+    tools.cache_features(c, trunk)
+    model = facial_recognizer_head(c, int(trunk.output_shape[-1]))
+    # weights are loaded into full model by facial_recognizer.load_recognizer
+    path_to_model = c.path_to_models+'/model_OE_head'
+else:
+    model = facial_recognizer(c)
+    path_to_model = c.path_to_models+'/model_OE'
+
 call_backs =[
     # EarlyStopping('val_acc', min_delta=1e-5, patience=20),
     ProgbarLogger('steps'),
-    ModelCheckpoint(c.path_to_models+'/model_OE', save_best_only=True),
+    ModelCheckpoint(path_to_model, save_best_only=True),
     TensorBoard(c.path_to_summaries)
     ]
 
-model = facial_recognizer(c)
 model.compile(
     # optimizer=SGD(lr=1e-3, momentum=0.9),
     optimizer='adam',
     loss={'out_au': 'binary_crossentropy',
           'out_emotion': 'categorical_crossentropy'})
 
-train_gen = tools.fake_generator(c)
-for _ in range(10):
-    next(train_gen)
+train_gen, test_gen = tools.get_generators(c)
+call_backs.append(tools.SequenceCheckpoint(train_gen))
 model.fit_generator(generator=train_gen,
-                    steps_per_epoch=200,
+                    steps_per_epoch=len(train_gen),
                     epochs=c.epochs,
                     verbose=1,
                     callbacks=call_backs,
-                    # validation_data=test_gen,
-                    # validation_steps=50,
-                    max_queue_size=c.max_queue_size,
-                    workers=c.workers)
-model.save(c.path_to_models+'/model_OE')
\ No newline at end of file
+                    validation_data=test_gen,
+                    validation_steps=len(test_gen),
+                    max_queue_size=tools.queue_size(train_gen, c.max_queue_size),
+                    workers=c.workers,
+                    use_multiprocessing=c.use_multiprocessing)
+model.save(path_to_model)
\ No newline at end of file